@@ -1,35 +1,90 @@
+from collections import Counter
 import math
-from multiprocessing import Pool
-import random
+import json
 import numpy as np
 import cv2
+import os
 import time
+from typing import Iterator
 
+from context import RenderContext
+import engine
 import functions
+import kernels
+import orbits
+import palette
 
 
 class Buddhabrot:
-    def __init__(self, width: int, k: int, n: int, percentage: float = 0.5, threads: int = 8, info: bool = True):
+    transient = ('arr', 'halves', 'context')  # not needed by workers
+
+    def __init__(self, width: int, k: int or list[int, ...], n: int or list[int, ...], percentage: float = 0.5, threads: int = 8, info: bool = True, context: RenderContext = None, batch: int = 4096, chunk: int = 2 ** 18,
+                 sampling: str = 'uniform', chains: int = 1024, warmup: int = 2 ** 18, burn_in: int = 32, large_step: float = 0.2, seed: int = None,
+                 periodicity: bool = False, bulbs: int = 2):
+        if sampling not in ('uniform', 'metropolis'):
+            raise ValueError(f"'sampling' must be 'uniform' or 'metropolis' not {sampling!r}")
+        if bulbs < 0:
+            raise ValueError(f"'bulbs' must not be negative not {bulbs}")
         self.w = width
-        self.k = min(k, n)
-        self.n = max(k, n)
+        self.multi = np.ndim(k) > 0  # channels of a Nebulabrot, one (k, n) window each
+        self.windows = [(min(a, b), max(a, b)) for a, b in (zip(k, n) if self.multi else [(k, n)])]
+        self.k = min(a for a, _ in self.windows)
+        self.n = max(b for _, b in self.windows)  # orbits are iterated once, up to the deepest window
         self.real = (-2, 2)
         self.imag = (-2, 2)
+        self.domain = ((-2, 2), (-2, 2))  # c are sampled here and orbits end when they leave it
         self.percentage = percentage
         self.threads = threads
         self.info = info
+        self.context = context
+        self.batch = batch  # orbits iterated together, see orbits
+        self.chunk = chunk  # uniform samples generated at a time per worker
+        self.sampling = sampling
+        self.chains = chains  # Metropolis-Hastings chains per worker
+        self.warmup = warmup  # uniform samples per worker to start the chains from, most of the hits of points_mean
+        self.burn_in = burn_in  # chain steps before recording
+        self.large_step = large_step  # probability of a uniform instead of a small mutation
+        self.seed = seed
+        self.periodicity = periodicity  # exact cycle check ends interior orbits early, see engine.Periodicity
+        self.bulbs = bulbs  # samples in components up to this period are rejected without iterating, see engine.interior
+        self.disks = engine.bulb_disks(bulbs) if bulbs > 2 else None
+        self.entropy = seed
+        self.round = None  # round of progressive, part of the seeds
+        self.round_samples: int
+        self.stats = Counter()
 
         self.arr: np.ndarray
         self.elapsed: float
-        self.numbers: list[complex, ...]
+        self.halves: np.ndarray  # histograms of even and odd rounds of progressive, unscaled for metropolis
+        self.scale_counts = [0, 0, 0, 0.]  # uniform samples of all chains with points in view, all of them, recorded chain steps, their sum of 1 / points, see points_mean
 
     def __str__(self):
         z_range = f'({complex(self.real[0], self.imag[0])}, {complex(self.real[1], self.imag[1])})'.replace('(', '').replace(')', '').replace('j', 'i')
-        return f'Buddhabrot; ({z_range}); img({self.w}, {self.h()}); k{self.k}, n{self.n}; th{self.threads}; t{round(self.elapsed, 2)}; p{round(self.percentage, 2)}'
+        return f'Buddhabrot; ({z_range}); img({self.w}, {self.h()}); {self.window_text()}; th{self.threads}; t{round(self.elapsed, 2)}; p{round(self.percentage, 2)}'
 
     def __repr__(self):
         z_range = f'({complex(self.real[0], self.imag[0])}, {complex(self.real[1], self.imag[1])})'.replace('(', '').replace(')', '').replace('j', 'i')
-        return f'Buddhabrot; ({z_range}); ({self.w}, {self.h()}); ({self.k}, {self.n}); {round(self.elapsed, 2)}; {round(self.percentage, 2)}'
+        return f'Buddhabrot; ({z_range}); ({self.w}, {self.h()}); {self.window_text()}; {round(self.elapsed, 2)}; {round(self.percentage, 2)}'
+
+    def window_text(self) -> str:
+        if self.multi:
+            return f"k({', '.join(str(k) for k, _ in self.windows)}), n({', '.join(str(n) for _, n in self.windows)})"
+        return f'k{self.k}, n{self.n}'
+
+    def memberships(self, left_at: np.ndarray) -> np.ndarray:  # (orbits, channels) k < exit < n of every window
+        left_at = np.asarray(left_at)[:, None]
+        k, n = np.array(self.windows).T
+        return (k < left_at) & (left_at < n)
+
+    def selected(self, left_at: np.ndarray) -> np.ndarray:  # orbits of at least one channel
+        return self.memberships(left_at).any(axis=1)
+
+    def histogram(self) -> np.ndarray:  # (h, w), (channels, h, w) with windows
+        h = round(self.h())
+        return np.zeros((len(self.windows), h, self.w) if self.multi else (h, self.w))
+
+    def trace(self, f, c: np.ndarray, left_at: np.ndarray, arr: np.ndarray, **kwargs) -> None:  # see orbits.trace, every orbit into the channels it belongs to
+        orbits.trace(f, c, left_at, self.real, self.imag, (self.w, round(self.h())), arr, self.batch, channels=self.memberships(left_at) if self.multi else None, **kwargs)
 
     @staticmethod
     def f(z, c):
@@ -53,62 +108,292 @@ class Buddhabrot:
     def p_2(z: complex) -> bool:  # main disk
         return abs(z + 1) < 0.25
 
+    def in_bulbs(self, c: np.ndarray) -> np.ndarray:  # vectorized p_1(c) or p_2(c), or one of the disks of bulbs up to period bulbs
+        if self.bulbs == 0:
+            return np.zeros(np.shape(c), dtype=bool)
+        return engine.interior(c, self.disks)
+
+    def inside(self, z: np.ndarray) -> np.ndarray:  # orbits end when they leave the domain, rounded like functions.complex2yx if it is the view
+        if (self.real, self.imag) == self.domain:
+            return orbits.in_view(z, self.real, self.imag, (self.w, round(self.h())))
+        (re1, re2), (im1, im2) = self.domain
+        return (re1 <= z.real) & (z.real <= re2) & (im1 <= z.imag) & (z.imag <= im2)
+
     def h(self, w: int = None, real: tuple = None, imag: tuple = None) -> int:
         w = self.w if w is None else w
         real = self.real if real is None else real
         imag = self.imag if imag is None else imag
         return round(w * abs(self.diff(imag) / self.diff(real)))
 
-    def thread(self, t: int) -> np.ndarray:  # deep iteration
+    def rng(self, t: int) -> np.random.Generator:  # independent stream of worker t (in round), reproducible from seed (or entropy drawn in calculate)
+        spawn_key = (t,) if self.round is None else (t, self.round)
+        return np.random.default_rng(np.random.SeedSequence(self.entropy, spawn_key=spawn_key))
+
+    def samples(self, t: int) -> int:  # samples of worker t, all workers together take round(percentage * w * h) or round_samples per round
+        total = round(self.percentage * self.w * round(self.h())) if self.round is None else self.round_samples
+        return total // self.threads + (t < total % self.threads)
+
+    def uniform_chunks(self, rng: np.random.Generator, size: int, stats: Counter = None) -> Iterator[np.ndarray]:  # size uniform c outside the bulbs, at most chunk at a time
+        while size > 0:
+            c = self.uniform(rng, min(self.chunk, size))
+            bulbs = self.in_bulbs(c)
+            if stats is not None:
+                stats['pre-rejected samples'] += int(np.count_nonzero(bulbs))
+            c = c[~bulbs]
+            size -= c.size
+            yield c
+
+    def thread(self, t: int) -> tuple[np.ndarray, Counter]:  # deep iteration
+        arr, stats = self.histogram(), Counter()
+        f = kernels.compile_f(self.f)
+        rng = self.rng(t)
+        size, done = self.samples(t), 0
+        progress = self.progress if self.info and t == 0 else None
+
+        for c in self.uniform_chunks(rng, size, stats):
+            i = orbits.exits(f, c, self.n, self.inside, self.batch, progress and (lambda p: progress((done + p * c.size / 2) / size)),
+                             periodicity=self.periodicity, stats=stats)
+            selected = self.selected(i)  # k < i < n
+            self.trace(f, c[selected], i[selected], arr, progress=progress and (lambda p: progress((done + c.size / 2 + p * c.size / 2) / size)))
+            done += c.size
+        if progress:
+            print(f'\r[INFO] calculate | 100%')
+        return arr, stats
+
+    def uniform(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        (re1, re2), (im1, im2) = self.domain
+        return rng.uniform(re1, re2, size) + 1j * rng.uniform(im1, im2, size)
+
+    def chain(self, t: int) -> tuple[np.ndarray, Counter]:
+        '''Metropolis-Hastings: c are visited with density ∝ points of their orbit in view, every orbit is weighted by 1 / points
+        so that the histogram estimates uniform sampling with as many samples
+        chains run asynchronously: a chain takes its next step as soon as the orbit of its proposal has left the domain'''
         h = round(self.h())
-        arr = np.zeros((h, self.w))
-
-        len_numbers = len(self.numbers[t::self.threads])
-        print_every = len_numbers // 1000
-        for n, c in enumerate(self.numbers[t::self.threads]):
-            z, points = 0, []
-            for i in range(self.n):
-                z = self.f(z, c)
-                y, x = functions.complex2yx(z, self.real, self.imag, (self.w, h))
-                if 0 <= x < self.w and 0 <= y < h:  # in view
-                    points.append((y, x))
-                else:
-                    if self.k < i:  # k < i < n
-                        for j, k in points:
-                            arr[j, k] += 1
-                    break
-            if self.info and t == 0 and n % print_every == 0:
-                print(f'\r[INFO] calculate | {round(100 * n / len_numbers, 1)}%', end='')
+        shape, arr, stats = (self.w, h), self.histogram(), Counter()
+        f = kernels.compile_f(self.f)
+        rng = self.rng(t)
+        pixel = self.diff(self.real) / self.w
+        r_min, r_max = pixel / 8, 8 * pixel  # small mutations, log-uniform
+
+        # warm-up: chains started from uniform samples drawn ∝ points, these and the large steps count for points_mean
+        samples = self.uniform(rng, self.warmup)
+        outside = ~self.in_bulbs(samples)  # uniform sampling draws samples in the bulbs again, see uniform_chunks
+        left_at, points = np.full(samples.size, self.n), np.zeros(samples.size, dtype=np.int64)
+        left_at[outside], points[outside] = orbits.contributions(f, samples[outside], self.n, self.selected, self.inside, self.real, self.imag, shape, self.batch)
+        stats['warm-up samples'] += samples.size
+        stats['uniform hits'] += int(np.count_nonzero(points))
+        stats['uniform samples'] += int(np.count_nonzero(outside))
+        if points.sum() == 0:
+            return arr, stats
+        start = rng.choice(samples.size, self.chains, p=points / points.sum())
+        c, left_at, points = samples[start], left_at[start], points[start]
+        held, steps = np.zeros(self.chains), np.zeros(self.chains, dtype=np.int64)
+        total = self.burn_in + max(1, self.samples(t) // self.chains)
+        proposals, large = np.zeros(self.chains, dtype=complex), np.zeros(self.chains, dtype=bool)
+        proposal_left_at, proposal_points = np.full(self.chains, self.n), np.zeros(self.chains, dtype=np.int64)
+        queue = []  # (c, exits, weights) of states the chains moved away from, traced batch by batch
+        shown = None  # percentage printed last
+
+        def trace(force: bool = False) -> None:
+            if sum(len(q[0]) for q in queue) >= self.batch or force and queue:
+                c_q, left_at_q, weights = (np.concatenate(q) for q in zip(*queue))
+                self.trace(f, c_q, left_at_q, arr, weights=weights)
+                queue.clear()
+
+        def decide(ids: np.ndarray) -> None:  # one step of the chains ids, their proposals are evaluated
+            accept = rng.random(ids.size) * points[ids] < proposal_points[ids]
+            moved = ids[accept & (held[ids] > 0)]
+            if moved.size:
+                queue.append((c[moved], left_at[moved], held[moved] / points[moved]))
+                stats['inverse points'] += float(queue[-1][2].sum())
+            accepted = ids[accept]
+            c[accepted], left_at[accepted], points[accepted], held[accepted] = proposals[accepted], proposal_left_at[accepted], proposal_points[accepted], 0
+            recorded = ids[steps[ids] >= self.burn_in]
+            held[recorded] += 1
+            stats['recorded'] += recorded.size
+            steps[ids] += 1
+            stats['samples'] += ids.size
+            stats['accepted'] += accepted.size
+
+        def propose(ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # chains whose proposals have to be iterated, proposals in the bulbs are rejected right away
+            ready = []
+            ids = ids[steps[ids] < total]
+            while ids.size:
+                small = rng.random(ids.size) >= self.large_step
+                large[ids] = ~small
+                proposals[ids] = self.uniform(rng, ids.size)
+                r = r_min * (r_max / r_min) ** rng.random(np.count_nonzero(small))
+                proposals[ids[small]] = c[ids[small]] + r * np.exp(2j * np.pi * rng.random(r.size))
+                bulbs = self.in_bulbs(proposals[ids])
+                stats['pre-rejected samples'] += int(np.count_nonzero(bulbs))
+                ready.append(ids[~bulbs])
+                ids = ids[bulbs]
+                proposal_points[ids] = 0
+                decide(ids)
+                ids = ids[steps[ids] < total]
+            ready = np.concatenate(ready) if ready else ids
+            proposal_left_at[ready], proposal_points[ready] = self.n, 0
+            return ready, proposals[ready]
+
+        def visit(ids: np.ndarray, iterations: np.ndarray, z: np.ndarray) -> np.ndarray:
+            left = ~self.inside(z)
+            proposal_left_at[ids[left]] = iterations[left]
+            proposal_points[ids[~left]] += orbits.in_view(z[~left], self.real, self.imag, shape)
+            return left | (iterations >= self.n - 1)
+
+        def refill(finished: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            nonlocal shown
+            selected = self.selected(proposal_left_at[finished])  # k < i < n
+            proposal_points[finished[~selected]] = 0
+            draws = finished[large[finished]]  # uniform samples outside the bulbs
+            stats['uniform hits'] += int(np.count_nonzero(proposal_points[draws]))
+            stats['uniform samples'] += draws.size
+            decide(finished)
+            trace()
+            if self.info and t == 0 and shown != (shown := round(100 * steps.sum() / (total * self.chains), 1)):
+                self.progress(shown / 100)
+            return propose(finished)
+
+        orbits.run(f, *propose(np.arange(self.chains)), visit, refill)
+        recorded = held > 0
+        queue.append((c[recorded], left_at[recorded], held[recorded] / points[recorded]))
+        stats['inverse points'] += float(queue[-1][2].sum())
+        trace(force=True)
         if self.info and t == 0:
             print(f'\r[INFO] calculate | 100%')
-        return arr
+        return arr, stats
+
+    @staticmethod
+    def progress(fraction: float) -> None:
+        print(f'\r[INFO] calculate | {round(100 * fraction, 1)}%', end='')
 
     def calculate(self) -> float:
-        imag, h = (-2, 2), round(self.h())
         start = time.time()
 
         if self.info:
             print(f'[INFO] calculate | {self.threads} threads, percentage = {self.percentage}')
+            if self.sampling == 'uniform':
+                print(f'[INFO] calculate | {sum(self.samples(t) for t in range(self.threads))}/{self.w * self.h()} pixels')
 
-        self.numbers = []
-        for _ in range(round(self.percentage * self.w * h)):
-            while True:
-                c = complex(random.uniform(*imag), random.uniform(*self.real))
-                if not (self.p_2(c) or self.p_1(c)):  # in Mandelbrot set
-                    self.numbers.append(c)
-                    break
-
-        if self.info:
-            print(f'[INFO] calculate | {len(self.numbers)}/{self.w * self.h()} pixels')
-
-        pool = Pool(self.threads)
-        self.arr = sum(pool.map(self.thread, range(self.threads)))
-        pool.close()
+        self.entropy = np.random.SeedSequence(self.seed).entropy
+        self.round, self.stats, self.scale_counts = None, Counter(), [0, 0, 0, 0.]
+        context = self.context or RenderContext(self.threads)
+        self.arr, _ = self.accumulate(context)
+        self.arr *= self.points_mean()
+        if self.context is None:
+            context.close()
 
         self.elapsed = time.time() - start
 
         if self.info:
             print(f'[INFO] calculate | finished in {round(self.elapsed, 2)}s')
+            if self.sampling == 'metropolis':
+                self.print_stats()
+            elif self.stats:
+                print(f'[INFO] calculate | {", ".join(f"{key} = {value}" for key, value in self.stats.items())}')
+        return self.elapsed
+
+    def accumulate(self, context: RenderContext) -> tuple[np.ndarray, int]:  # (histogram, uniform samples it amounts to) of one pass of all workers, metropolis ones still need points_mean
+        results = context.map(self, 'chain' if self.sampling == 'metropolis' else 'thread', range(self.threads))
+        stats = sum((stats for _, stats in results), Counter())
+        self.stats += stats
+        arr = sum(arr for arr, _ in results)
+        if self.sampling == 'metropolis':
+            self.scale_counts = [a + stats[key] for a, key in zip(self.scale_counts, ('uniform hits', 'uniform samples', 'recorded', 'inverse points'))]
+            return arr, stats['recorded']
+        return arr, sum(self.samples(t) for t in range(self.threads))
+
+    def points_mean(self) -> float:
+        '''mean points in view of a uniform sample, the scale of metropolis histograms (see chain), 1 for uniform sampling
+        chains visit c ∝ points, so the mean of 1 / points over their steps is P(points > 0) / mean, both bounded unlike the heavy-tailed points themselves,
+        P(points > 0) comes from the uniform samples, one estimate from all chains of all rounds, so workers and resumed runs share it'''
+        if self.sampling != 'metropolis':
+            return 1.
+        hits, samples, recorded, inverse = self.scale_counts
+        return hits / samples * recorded / inverse if inverse else 0.
+
+    def print_stats(self) -> None:
+        print(f"[INFO] calculate | {round(self.stats['samples'] / self.elapsed)} samples/s | acceptance rate = {round(100 * self.stats['accepted'] / max(1, self.stats['samples']), 1)}%")
+
+    def checkpoint_params(self) -> dict:  # everything a checkpoint depends on
+        return {'type': type(self).__name__, 'width': self.w, 'height': round(self.h()), 'windows': [list(window) for window in self.windows], 'real': list(self.real), 'imag': list(self.imag),
+                'domain': [list(axis) for axis in self.domain], 'sampling': self.sampling, 'bulbs': self.bulbs}  # rejected samples change the density
+
+    def load(self, checkpoint: str) -> dict:
+        '''state of checkpoint (see progressive), self.arr is set to its histogram, e.g. to save a preview of a running job'''
+        with open(f'{checkpoint}.json') as file:
+            state = json.load(file)
+        if state['params'] != self.checkpoint_params():
+            raise ValueError(f"checkpoint '{checkpoint}' was made with {state['params']} not {self.checkpoint_params()}")
+        self.halves = np.load(os.path.join(os.path.dirname(checkpoint), state['histogram']))
+        self.scale_counts = state['scale counts']
+        self.arr = self.halves.sum(axis=0) * self.points_mean()
+        self.elapsed = state['elapsed']
+        return state
+
+    def dump(self, checkpoint: str, state: dict) -> None:  # histogram first, the json is only replaced once it is written
+        previous = state.get('histogram')
+        state['histogram'] = f"{os.path.basename(checkpoint)}-{state['rounds']:06d}.npy"
+        np.save(os.path.join(os.path.dirname(checkpoint), state['histogram']), self.halves)
+        with open(f'{checkpoint}.json.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(f'{checkpoint}.json.tmp', f'{checkpoint}.json')
+        if previous is not None and previous != state['histogram']:
+            os.remove(os.path.join(os.path.dirname(checkpoint), previous))
+
+    def noise(self, samples: list[int, int]) -> float:
+        '''relative error of the estimate per sample from the halves of even and odd rounds,
+        they differ by about twice the error of their mean'''
+        if min(samples) == 0:
+            return np.inf
+        a, b = self.halves[0] / samples[0], self.halves[1] / samples[1]
+        total = np.abs(a + b).sum()
+        return np.abs(a - b).sum() / total if total else np.inf
+
+    def progressive(self, checkpoint: str, round_samples: int = None, time_budget: float = None, sample_budget: int = None, noise: float = None,
+                    preview: str = None, percentile: float = 3.) -> float:
+        '''accumulates rounds of round_samples samples until time_budget (seconds), sample_budget or noise (see self.noise) is reached, checked between rounds
+        after every round the histogram is saved to a .npy next to checkpoint.json, which holds the sample count, the seed and the points_mean counts of the rounds,
+        an existing checkpoint is resumed, previews are saved with self.save(preview, percentile=percentile) after every round'''
+        if time_budget is None and sample_budget is None and noise is None:
+            raise ValueError("one of 'time_budget', 'sample_budget' and 'noise' is needed")
+        start = time.time()
+        if os.path.exists(f'{checkpoint}.json'):
+            state = self.load(checkpoint)
+            if self.info:
+                print(f"[INFO] progressive | resumed '{checkpoint}' after {state['rounds']} rounds, {sum(state['samples'])} samples")
+        else:
+            self.halves, self.scale_counts = np.stack([self.histogram()] * 2), [0, 0, 0, 0.]
+            state = {'params': self.checkpoint_params(), 'entropy': np.random.SeedSequence(self.seed).entropy, 'rounds': 0, 'samples': [0, 0], 'scale counts': [0, 0, 0, 0.], 'elapsed': 0.}
+        self.entropy = state['entropy']
+        self.round_samples = round_samples or self.threads * self.chunk
+        elapsed = state['elapsed']
+
+        context = self.context or RenderContext(self.threads)
+        try:
+            while not ((time_budget is not None and state['elapsed'] >= time_budget) or (sample_budget is not None and sum(state['samples']) >= sample_budget)
+                       or (noise is not None and self.noise(state['samples']) <= noise)):
+                self.round = state['rounds']
+                arr, samples = self.accumulate(context)
+                self.halves[self.round % 2] += arr
+                state['samples'][self.round % 2] += samples
+                state['scale counts'] = self.scale_counts
+                state['rounds'] += 1
+                state['elapsed'] = elapsed + time.time() - start
+                self.dump(checkpoint, state)
+                self.arr, self.elapsed = self.halves.sum(axis=0) * self.points_mean(), state['elapsed']
+                if self.info:
+                    print(f"[INFO] progressive | round {state['rounds']} | {sum(state['samples'])} samples | noise = {round(self.noise(state['samples']), 4)} | {round(self.elapsed, 2)}s")
+                if preview is not None:
+                    self.save(preview, percentile=percentile)
+        finally:
+            self.round = None
+            if self.context is None:
+                context.close()
+
+        self.arr, self.elapsed = self.halves.sum(axis=0) * self.points_mean(), state['elapsed']
+        if self.info and self.sampling == 'metropolis' and self.stats['samples']:
+            self.print_stats()
         return self.elapsed
 
     def normalize_arr(self, arr: np.ndarray, percentile: float) -> np.ndarray:
@@ -122,27 +407,32 @@ class Buddhabrot:
         # arr += arr[::-1]
         return arr
 
-    def show(self, percentile: float = 3.):
-        arr = self.normalize_arr(self.arr, percentile)
+    def colorized(self, percentile: float, colors: list = None) -> np.ndarray:  # BGR composite of the channels, see palette.channels
+        return np.concatenate(list(palette.channels(self.arr, colors, percentile)))
+
+    def show(self, percentile: float = 3., colors: list = None):
+        arr = self.colorized(percentile, colors) if self.multi else self.normalize_arr(self.arr, percentile)
         arr *= 255/arr.max()
         cv2.imshow(repr(self), arr.astype(np.uint8))
         if self.info:
             print('[INFO] show')
         cv2.waitKey(0)
 
-    def save(self, filename: str = None, depth: int = 16, percentile: float = 3., boxes: float = 0.):
+    def save(self, filename: str = None, depth: int = 16, percentile: float = 3., boxes: float = 0., colors: list = None):  # colors of the channels, palette.spectrum by default
         if filename is None:
             filename = str(self)
         dtype = np.uint8 if depth == 8 else np.uint16 if depth == 16 else None
         if dtype is None:
             raise ValueError(f"'depth' must be 8 or 16 not {depth}")
 
-        img_arr = (2 ** depth - 1) * self.normalize_arr(self.arr, percentile)
-        cv2.imwrite(f'{filename}.png', img_arr.astype(dtype))
+        if self.multi:
+            palette.save(f'{filename}.png', self.arr.shape[1:], palette.channels(self.arr, colors, percentile), depth)
+        else:
+            img_arr = (2 ** depth - 1) * self.normalize_arr(self.arr, percentile)
+            cv2.imwrite(f'{filename}.png', img_arr.astype(dtype))
         if self.info:
             print(f"[INFO] saved to '{filename}.png'")
 
-
 if __name__ == '__main__':
     buddhabrot = Buddhabrot(4000, 100000, 200000, 0.8)
     buddhabrot.calculate()
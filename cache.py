@@ -0,0 +1,85 @@
+import hashlib
+from inspect import getsource
+import numpy as np
+import os
+from typing import Callable
+
+
+class TileCache:
+    def __init__(self, directory: str = '__tile_cache__', max_bytes: int = 2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.written = 0  # bytes written by this process since the last eviction
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def source(f: Callable) -> str:
+        try:
+            return getsource(f)
+        except (OSError, TypeError):
+            return f'{getattr(f, "__module__", "")}.{getattr(f, "__qualname__", repr(f))}'
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.npy')
+
+    def get(self, key: str) -> np.ndarray or None:
+        path = self.path(key)
+        try:
+            tile = np.load(path, mmap_mode='r')
+            os.utime(path)  # most recently used
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return tile
+
+    def put(self, key: str, tile: np.ndarray) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as file:
+            np.save(file, tile)
+        os.replace(temp, path)  # atomic, other workers never see partial tiles
+
+        self.written += tile.nbytes
+        if self.written > self.max_bytes // 16:
+            self.evict()
+
+    def files(self) -> list[tuple[float, int, str]]:  # (last used, size, path)
+        files = []
+        for folder in os.scandir(self.directory):
+            if folder.is_dir():
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith('.npy'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    @property
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.files())
+
+    def evict(self) -> None:  # least recently used tiles until 90% of max_bytes
+        self.written = 0
+        files = sorted(self.files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, path in self.files():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
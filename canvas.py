@@ -0,0 +1,63 @@
+from multiprocessing import shared_memory
+import numpy as np
+import os
+import tempfile
+
+
+class SharedCanvas:
+    def __init__(self, shape: tuple[int, ...], name: str = None):
+        self.shape = tuple(shape)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=max(1, 8 * int(np.prod(self.shape))))
+        self.arr = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+        if name is None:
+            self.arr[...] = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close(unlink=True)
+
+    @property
+    def spec(self) -> tuple[type, str, tuple[int, ...]]:  # enough to attach from another process
+        return type(self), self.shm.name, self.shape
+
+    def close(self, unlink: bool = False) -> None:
+        del self.arr  # release the buffer before closing
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class MappedCanvas(SharedCanvas):  # same as SharedCanvas but backed by a file, the OS pages it in and out
+    def __init__(self, shape: tuple[int, ...], name: str = None, directory: str = None):
+        self.shape = tuple(shape)
+        self.created = name is None
+        if self.created:
+            fd, name = tempfile.mkstemp(suffix='.canvas', dir=directory)
+            os.close(fd)
+        self.name = name
+        self.arr = np.memmap(name, dtype=np.float64, mode='w+' if self.created else 'r+', shape=self.shape)  # w+ zero-fills
+
+    @property
+    def spec(self) -> tuple[type, str, tuple[int, ...]]:
+        return type(self), self.name, self.shape
+
+    def close(self, unlink: bool = False) -> None:
+        self.arr.flush()
+        del self.arr
+        if unlink:
+            os.remove(self.name)
+
+
+def memmap(shape: tuple[int, ...], directory: str = None) -> np.memmap:  # zeros in an anonymous temporary file, removed once the array is gone
+    return np.memmap(tempfile.TemporaryFile(suffix='.arr', dir=directory), dtype=np.float64, mode='w+', shape=tuple(shape))
+
+
+def add_locked(arr: np.ndarray, indices: np.ndarray, counts: np.ndarray, locks: list) -> None:  # arr.flat[indices] += counts, sorted unique indices, one lock per row strip
+    bounds = np.linspace(0, arr.size, len(locks) + 1).astype(int)
+    cuts = np.searchsorted(indices, bounds)
+    for lock, a, b in zip(locks, cuts[:-1], cuts[1:]):
+        if a < b:
+            with lock:
+                arr.flat[indices[a:b]] += counts[a:b]
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+from multiprocessing import Lock, Pool, shared_memory
+from multiprocessing.pool import AsyncResult
+import os
+import pickle
+from typing import Callable, Iterable
+
+import scheduler
+
+
+class RenderContext:
+    def __init__(self, threads: int = 8):
+        self.threads = threads
+        self.pool, self.locks = None, []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self) -> None:
+        if self.pool is not None:
+            return
+        if os.name == 'posix':  # workers have to share the resource tracker of shared memory created later on
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self.locks = [Lock() for _ in range(4 * self.threads)]
+        self.pool = Pool(self.threads, initializer=scheduler.initializer, initargs=(self.locks,))
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    @contextmanager
+    def publish(self, obj):  # obj without its transient attributes, pickled once for all workers
+        state = obj.__dict__.copy()
+        for name in getattr(obj, 'transient', ()):
+            state[name] = None
+        copy = object.__new__(type(obj))
+        copy.__dict__.update(state)
+
+        data = pickle.dumps(copy)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        shm.buf[:len(data)] = data
+        try:
+            yield shm.name, len(data)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def imap(self, function: Callable, jobs: Iterable):
+        self.open()
+        return self.pool.imap_unordered(function, jobs)
+
+    def apply(self, key: tuple[str, int], method: str, arg) -> AsyncResult:  # obj.method(arg) in a worker without waiting, obj published with key, see publish
+        self.open()
+        return self.pool.apply_async(scheduler.call, ((key, method, arg),))
+
+    def map(self, obj, method: str, args: Iterable) -> list:  # obj.method(arg) for every arg in the workers
+        self.open()
+        with self.publish(obj) as key:
+            return self.pool.map(scheduler.call, [(key, method, arg) for arg in args], chunksize=1)
@@ -0,0 +1,158 @@
+from collections import Counter
+from functools import lru_cache
+import math
+import numpy as np
+from typing import Callable
+
+
+class Periodicity:  # Brent-style cycle check of one orbit: z is compared with the point saved after 1, 3, 7, 15, ... iterations
+    def __init__(self, z: complex, tolerance: float = 0.):
+        self.saved, self.tolerance = z, tolerance
+        self.period, self.limit = 0, 1
+
+    def __call__(self, z: complex) -> bool:  # True once z repeats the saved point, exactly if tolerance is 0, then the orbit never escapes
+        if (z == self.saved) if self.tolerance == 0 else abs(z - self.saved) <= self.tolerance:
+            return True
+        self.period += 1
+        if self.period == self.limit:
+            self.saved, self.period, self.limit = z, 0, 2 * self.limit
+        return False
+
+
+def cycled(z: np.ndarray, saved: np.ndarray, tolerance: float = 0.) -> np.ndarray:  # vectorized Periodicity check
+    return (z == saved) if tolerance == 0 else np.abs(z - saved) <= tolerance
+
+
+def escape_time(f: Callable, z: np.ndarray, c, max_iterations: int, extra_iterations: int, max_magnitude: float,
+                periodicity: bool = False, tolerance: float = 0., stats: Counter = None) -> tuple[np.ndarray, np.ndarray]:
+    '''same result as Julia.calculate_pixel for every element: (z, i) with i = 0 if not escaped
+    with periodicity, pixels whose orbit repeats a saved point (see Periodicity) stop early as not escaped, stats['saved iterations'] counts the skipped iterations'''
+    shape = np.shape(z)
+    z = np.array(z, dtype=complex).ravel()
+    c_is_arr = np.ndim(c) != 0
+    if c_is_arr:
+        c = np.broadcast_to(c, shape).ravel()
+
+    z_out, i_out = z.copy(), np.zeros(z.size, dtype=int)
+    active = np.arange(z.size)  # indices of pixels that have not escaped yet
+    saved, period, limit = z.copy() if periodicity else None, 0, 1
+    with np.errstate(over='ignore', invalid='ignore'):
+        for i in range(max_iterations):
+            z = f(z=z, c=c)
+            escaped = np.abs(z) > max_magnitude
+            if escaped.any():
+                z_escaped, c_escaped = z[escaped], c[escaped] if c_is_arr else c
+                for _ in range(extra_iterations):
+                    z_escaped = f(z=z_escaped, c=c_escaped)
+                z_out[active[escaped]] = z_escaped
+                i_out[active[escaped]] = i
+
+                # drop escaped pixels
+                inside = ~escaped
+                z, active = z[inside], active[inside]
+                if c_is_arr:
+                    c = c[inside]
+                if periodicity:
+                    saved = saved[inside]
+                if active.size == 0:
+                    break
+
+            if periodicity:
+                trapped = cycled(z, saved, tolerance)
+                if trapped.any():
+                    if stats is not None:
+                        stats['saved iterations'] += int(np.count_nonzero(trapped)) * (max_iterations - i - 1)
+                    z_out[active[trapped]] = z[trapped]
+                    inside = ~trapped
+                    z, active, saved = z[inside], active[inside], saved[inside]
+                    if c_is_arr:
+                        c = c[inside]
+                    if active.size == 0:
+                        break
+                period += 1
+                if period == limit:
+                    saved, period, limit = z.copy(), 0, 2 * limit
+        z_out[active] = z
+    return z_out.reshape(shape), i_out.reshape(shape)
+
+
+def smooth(z: np.ndarray, i: np.ndarray, exponent: int) -> np.ndarray:
+    # vectorized Julia.continuous
+    arr = np.zeros(np.shape(i))
+    escaped = i != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        arr[escaped] = i[escaped] + 0.5 - np.log(np.log(np.abs(z[escaped]))) / np.log(exponent)
+    arr[arr <= 0] = 0.0
+    return arr
+
+
+def interior(c, disks: tuple[np.ndarray, np.ndarray] = None) -> np.ndarray:
+    '''c in the main cardioid or the period-2 disk of z ** 2 + c, exact tests without iterating, or in one of the disks (centers, radii), see bulb_disks
+    the cardioid is e^(iθ)/2 - e^(2iθ)/4 and θ is the angle of c - 1/4, so c is compared with the boundary point on its ray from 1/4'''
+    c = np.asarray(c, dtype=complex)
+    shifted = c - 0.25
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c0 = shifted / (2 * np.abs(shifted))
+    inside = (np.abs(c) < np.abs(c0 - c0 ** 2)) | (np.abs(c + 1) < 0.25)
+    if disks is not None:
+        for center, radius in zip(*disks):
+            inside |= np.abs(c - center) < radius
+    return inside
+
+
+def nucleus(period: int, guess: complex, steps: int = 64) -> complex:  # c with f_c^period(0) = 0 near guess, Newton
+    c = guess
+    for _ in range(steps):
+        z, dz = 0j, 0j
+        for _ in range(period):
+            z, dz = z * z + c, 2 * z * dz + 1
+        if dz == 0:
+            break
+        step = z / dz
+        c -= step
+        if abs(step) < 1e-15:
+            break
+    return c
+
+
+def attracting(c: np.ndarray, period: int, iterations: int = 4096) -> np.ndarray:  # c whose orbit of 0 ends in an attracting cycle of the period
+    z = np.zeros_like(c)
+    with np.errstate(over='ignore', invalid='ignore'):
+        for _ in range(iterations):
+            z = z * z + c
+        for _ in range(8):  # Newton on f^period(z) = z for the cycle point
+            w, dw = z, np.ones_like(z)
+            for _ in range(period):
+                w, dw = w * w + c, 2 * w * dw
+            z = z - (w - z) / (dw - 1)
+        multiplier, w = np.ones_like(z), z
+        for _ in range(period):
+            multiplier, w = multiplier * 2 * w, w * w + c
+        return (np.abs(w - z) < 1e-9) & (np.abs(multiplier) < 1)
+
+
+@lru_cache
+def bulb_disks(max_period: int, samples: int = 256) -> tuple[np.ndarray, np.ndarray]:
+    '''(centers, radii) of disks inside the primary bulbs of z ** 2 + c with periods 3 to max_period, for interior
+    a disk around the nucleus of the p/q bulb through its root on the cardioid is shrunk until its boundary samples have an attracting q-cycle,
+    then once more by 10%; a numerical table, only the cardioid and the period-2 disk are exact'''
+    centers, radii = [], []
+    for q in range(3, max_period + 1):
+        for p in range(1, q):
+            if math.gcd(p, q) != 1:
+                continue
+            theta = 2 * math.pi * p / q
+            root = complex(np.exp(1j * theta) / 2 - np.exp(2j * theta) / 4)
+            size = math.sin(math.pi * p / q) / q ** 2  # approximate radius of the bulb
+            center = nucleus(q, root + size * (root - 0.25) / abs(root - 0.25))
+            radius = abs(center - root)
+            if not (0 < radius < 3 * size):  # Newton went to another component
+                continue
+            circle = center + radius * np.exp(2j * np.pi * np.arange(samples) / samples)
+            while radius > size / 100 and not attracting(circle, q).all():
+                radius *= 0.9
+                circle = center + radius * np.exp(2j * np.pi * np.arange(samples) / samples)
+            if radius > size / 100:
+                centers.append(center)
+                radii.append(0.9 * radius)
+    return np.array(centers, dtype=complex), np.array(radii)
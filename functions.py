@@ -1,12 +1,19 @@
 import numpy as np
-from numpy import sinh, sqrt
-from math import asinh
+from numpy import arcsinh as asinh, sinh, sqrt
+from typing import Iterator
+
+import palette
+import stream
 
 
 def xy2complex(x: float, y: float, real: tuple, imag: tuple, shape: tuple[int, int]) -> complex:
     return complex(linmap(x, (0, shape[0]), real), linmap(y, (0, shape[1]), imag))
 
 
+def grid2complex(x: np.ndarray, y: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int]) -> np.ndarray:
+    return linmap(x, (0, shape[0]), real) + 1j * linmap(y, (0, shape[1]), imag)
+
+
 def complex2yx(z: complex, real: tuple, imag: tuple, shape: tuple[int, int]) -> tuple[int, int]:
     return round(linmap(z.imag, imag, (0, shape[1]))), round(linmap(z.real, real, (0, shape[0])))
 
@@ -15,16 +22,9 @@ def linmap(values, actual_bounds, desired_bounds):
     return desired_bounds[0] + (values - actual_bounds[0]) * (desired_bounds[1] - desired_bounds[0]) / (actual_bounds[1] - actual_bounds[0])
 
 
-def gray2color(array: np.ndarray, black2color: tuple, white2color: tuple):
-    max_val = array.max()
-    h, w = array.shape
-    color_array = np.zeros((h, w, 3))
-    for i, y in enumerate(array):
-        for j, x in enumerate(y):
-            if x != 0.0:
-                bgr = [linmap(x, (0.0, max_val), (black2color[i], white2color[i])) for i in range(2, -1, -1)]
-                for channel, val in zip(range(3), bgr):
-                    color_array[i, j, channel] = val
+def gray2color(array: np.ndarray, black2color: tuple, white2color: tuple):  # colors as RGB, result as BGR, see palette
+    color_array = palette.Gradient([black2color, white2color])(array / array.max())
+    color_array[array == 0.0] = 0.0
     return color_array
 
 
@@ -34,6 +34,10 @@ def asinh_stretch(array: np.ndarray, percentile) -> np.ndarray:  # asinh/sinh st
     array /= array.max()
     # stretch
     median = np.median(np.percentile(array[np.nonzero(array)], 100 - percentile))
+    return stretch(array, median)
+
+
+def stretch(array: np.ndarray, median: float) -> np.ndarray:  # array in [0, 1] stretched in place so that median maps to 0.5
     if median != 0.5:
         if median < 0.5:
             a = sqrt(1 - 4 * median ** 2) / (2 * median ** 2)
@@ -41,30 +45,68 @@ def asinh_stretch(array: np.ndarray, percentile) -> np.ndarray:  # asinh/sinh st
         else:
             a = sqrt(1 - 4 * (1 - median) ** 2) / (2 * (1 - median) ** 2)
             f = sinh
-        f_a = f(a)
-        for i, y in enumerate(array):
-            for j, x in enumerate(y):
-                array[i, j] = 0 if x == 0 else f(a * x) / f_a
+        nonzero = array != 0
+        array[nonzero] = f(a * array[nonzero]) / f(a)
     return array
 
 
+def edges(array: np.ndarray, threshold: float) -> np.ndarray:  # pixels differing from a neighbour by more than threshold or in escape status
+    mask = np.zeros(array.shape, dtype=bool)
+    escaped = array != 0
+    for axis in (0, 1):
+        edge = (np.abs(np.diff(array, axis=axis)) > threshold) | (np.diff(escaped, axis=axis) != 0)
+        if axis == 0:
+            mask[:-1] |= edge
+            mask[1:] |= edge
+        else:
+            mask[:, :-1] |= edge
+            mask[:, 1:] |= edge
+    return mask
+
+
+
+def edge_pixels(array: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:  # (y, x) of the edges of array one row strip at a time, see stream.row_strips
+    h, w = array.shape
+    ys, xs = [np.zeros(0, dtype=np.intp)], [np.zeros(0, dtype=np.intp)]
+    for a, b in stream.row_strips(h, w):
+        top = max(a - 1, 0)  # one more row above and below for the neighbours
+        y, x = np.nonzero(edges(array[top:b + 1], threshold)[a - top:b - top])
+        ys.append(y + a)
+        xs.append(x)
+    return np.concatenate(ys), np.concatenate(xs)
+
+
 def progressbar(progress: float, length: int = 30):
     quarters = '_░▒▓█'
     done = int(progress * length)
     return (done * '█' + quarters[round(4 * (length * progress - done))] + int((1 - progress) * length) * '_')[:length]
 
 
-def boxes2arr(w: int, h: int, boxes: list, info: bool = False):
-    a = np.zeros((h, w))
-    length = len(boxes)
-    for n, ((x, y), size) in enumerate(boxes):
-        for i in range(size):
-            for j in range(size):
-                if i == 0 or j == 0 or i == size - 1 or j == size - 1:
-                    a[y + i, x + j] += max(w, h) // 5
-                a[y + i, x + j] += size
-        if info:
-            print(f'\r[INFO] boxes2arr | {progressbar(n/length)} | {round(100 * n/length, 2)}%\t', end='')
-    return a
+def box_events(w: int, h: int, boxes: list) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # corners of a 2d difference array, row-sorted: every square adds its size and its border adds max(w, h) // 5
+    x, y, size = np.array([(x, y, size) for (x, y), size in boxes], dtype=np.int64).reshape(-1, 3).T
+    border, inner = max(w, h) // 5, size > 2
+    x0, y0 = np.concatenate((x, x[inner] + 1)), np.concatenate((y, y[inner] + 1))
+    x1, y1 = np.concatenate((x + size, x[inner] + size[inner] - 1)), np.concatenate((y + size, y[inner] + size[inner] - 1))
+    x0, x1, y0, y1 = np.clip(x0, 0, w), np.clip(x1, 0, w), np.clip(y0, 0, h), np.clip(y1, 0, h)  # boxes may reach past the image
+    value = np.concatenate((size + border, np.full(np.count_nonzero(inner), -border))).astype(float)
+    rows, cols, values = np.concatenate((y0, y0, y1, y1)), np.concatenate((x0, x1, x0, x1)), np.concatenate((value, -value, -value, value))
+    order = np.argsort(rows, kind='stable')
+    return rows[order], cols[order], values[order]
+
+
+def box_strips(w: int, h: int, boxes: list, bounds: list[tuple[int, int]]) -> Iterator[np.ndarray]:  # rows of boxes2arr for consecutive (first, last) row bounds from 0
+    rows, cols, values = box_events(w, h, boxes)
+    running = np.zeros(w + 1)
+    for a, b in bounds:
+        i, j = np.searchsorted(rows, (a, b))
+        diff = np.zeros((b - a, w + 1))
+        np.add.at(diff, (rows[i:j] - a, cols[i:j]), values[i:j])
+        diff[0] += running
+        np.cumsum(diff, axis=0, out=diff)
+        running = diff[-1].copy()
+        yield np.cumsum(diff[:, :w], axis=1)
 
 
+def boxes2arr(w: int, h: int, boxes: list, info: bool = False):
+    return next(box_strips(w, h, boxes, [(0, h)]))
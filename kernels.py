@@ -0,0 +1,149 @@
+import ast
+from inspect import getsource
+import numpy as np
+from textwrap import dedent
+from typing import Callable
+
+
+class Kernel:
+    def __init__(self, f: Callable):
+        self.f = f
+        self.terms = polynomial(f)  # {(z power, c power): coefficient} or None
+        self.c_coefficient = 0
+        self.coefficients = None  # coefficients of z ** 0, z ** 1, ..., z ** degree
+        self.method = 'vectorize' if vectorizable(f) else 'frompyfunc'
+
+        if self.terms is not None and all(c_power == 0 or (z_power, c_power) == (0, 1) for z_power, c_power in self.terms):
+            self.c_coefficient = self.terms.get((0, 1), 0)
+            degree = max([z_power for z_power, c_power in self.terms if c_power == 0] + [0])
+            self.coefficients = [self.terms.get((n, 0), 0) for n in range(degree + 1)]
+            if degree == 0:
+                self.method = 'vectorize'
+            elif all(a == 0 for a in self.coefficients[:-1]) and self.coefficients[-1] == 1:
+                self.method = 'power'  # z ** n + a·c
+            else:
+                self.method = 'horner'
+
+    def __repr__(self):
+        return f'Kernel({self.f.__name__}; {self.method})'
+
+    @property
+    def degree(self) -> int or None:
+        return None if self.coefficients is None else len(self.coefficients) - 1
+
+    def __call__(self, z: np.ndarray, c) -> np.ndarray:  # may overwrite z
+        if self.method == 'power':
+            z = power(z, self.degree)
+        elif self.method == 'horner':
+            z = horner(z, self.coefficients)
+        elif self.method == 'vectorize':
+            return self.f(z=z, c=c)
+        else:
+            return np.frompyfunc(lambda z_, c_: self.f(z=z_, c=c_), 2, 1)(z, c).astype(complex)
+
+        if self.c_coefficient == 1:
+            np.add(z, c, out=z)
+        elif self.c_coefficient != 0:
+            z += self.c_coefficient * c
+        return z
+
+
+def compile_f(f: Callable) -> Kernel:
+    return f if isinstance(f, Kernel) else Kernel(f)
+
+
+def multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:  # a · b into a, numpy rounds in-place complex products of single elements differently
+    return np.multiply(a, b, out=a) if a.size > 1 else a * b
+
+
+def power(z: np.ndarray, n: int) -> np.ndarray:  # z ** n by repeated squaring, overwrites z
+    result = None
+    while True:
+        if n & 1:
+            if result is None:
+                result = z if n == 1 else z.copy()
+            else:
+                result = multiply(result, z)
+        n >>= 1
+        if n == 0:
+            return result
+        z = multiply(z, z)
+
+
+def horner(z: np.ndarray, coefficients: list) -> np.ndarray:  # Σ a_n · z ** n
+    result = coefficients[-1] * z
+    for a in coefficients[-2:0:-1]:
+        if a != 0:
+            result += a
+        result = multiply(result, z)
+    if coefficients[0] != 0:
+        result += coefficients[0]
+    return result
+
+
+def vectorizable(f: Callable) -> bool:
+    test = np.array([0.1 + 0.1j, -0.5j])
+    try:
+        with np.errstate(all='ignore'):
+            return np.shape(f(z=test.copy(), c=test.copy())) == test.shape
+    except Exception:
+        return False
+
+
+def polynomial(f: Callable) -> dict or None:
+    try:
+        tree = ast.parse(dedent(getsource(f)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+
+    function = tree.body[0]
+    if not isinstance(function, ast.FunctionDef):
+        return None
+    body = [node for node in function.body if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant))]  # skip docstring
+    if len(body) != 1 or not isinstance(body[0], ast.Return) or body[0].value is None:
+        return None
+    try:
+        terms = _terms(body[0].value)
+    except ValueError:
+        return None
+    return {powers: a for powers, a in terms.items() if a != 0}
+
+
+def _terms(node: ast.AST) -> dict:
+    if isinstance(node, ast.Name) and node.id in ('z', 'c'):
+        return {(1, 0) if node.id == 'z' else (0, 1): 1}
+    elif isinstance(node, ast.Constant) and type(node.value) in (int, float, complex):
+        return {(0, 0): node.value}
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        sign = -1 if isinstance(node.op, ast.USub) else 1
+        return {powers: sign * a for powers, a in _terms(node.operand).items()}
+    elif isinstance(node, ast.BinOp):
+        if isinstance(node.op, ast.Pow):
+            n = _terms(node.right)
+            if list(n) != [(0, 0)] or type(n[(0, 0)]) is not int or n[(0, 0)] < 0:
+                raise ValueError
+            result = {(0, 0): 1}
+            base = _terms(node.left)
+            for _ in range(n[(0, 0)]):
+                result = _multiply(result, base)
+            return result
+
+        left, right = _terms(node.left), _terms(node.right)
+        if isinstance(node.op, ast.Mult):
+            return _multiply(left, right)
+        elif isinstance(node.op, (ast.Add, ast.Sub)):
+            sign = -1 if isinstance(node.op, ast.Sub) else 1
+            for powers, a in right.items():
+                left[powers] = left.get(powers, 0) + sign * a
+            return left
+        elif isinstance(node.op, ast.Div) and list(right) == [(0, 0)]:
+            return {powers: a / right[(0, 0)] for powers, a in left.items()}
+    raise ValueError
+
+
+def _multiply(left: dict, right: dict) -> dict:
+    result = {}
+    for (z1, c1), a in left.items():
+        for (z2, c2), b in right.items():
+            result[(z1 + z2, c1 + c2)] = result.get((z1 + z2, c1 + c2), 0) + a * b
+    return result
@@ -1,17 +1,39 @@
+from collections import Counter
 import cv2
+from decimal import Decimal
 from inspect import getsource
-from multiprocessing import Pool
+import math
 import numpy as np
 import os
 import time
-from typing import Callable
-
+from threading import Lock
+from typing import Callable, Iterator
+
+from cache import TileCache
+import canvas
+from canvas import MappedCanvas, SharedCanvas
+from context import RenderContext
+import engine
 import functions
+import kernels
 from objects import *
+import orbits
+from palette import Gradient
+import perturbation
+import rotation
+import scheduler
+import stream
+import tiling
+import tonemap
+import writer
 
 
 class Julia:
-    def __init__(self, f: Callable, c: complex, width: int = 640, real: tuple[float, float] = (-2, 2), imag: tuple[float, float] = (-2, 2), max_iterations: int = 30, extra_iterations: int = 2, max_magnitude: float = 2, threads: int = 8, info: bool = True, exponent: int = 2, oversample: int = 1, square_tiling: bool = True, check: bool = False):
+    transient = ('arr', 'checked', 'squares', 'context')  # not needed by workers
+
+    def __init__(self, f: Callable, c: complex, width: int = 640, real: tuple[float, float] = (-2, 2), imag: tuple[float, float] = (-2, 2), max_iterations: int = 30, extra_iterations: int = 2, max_magnitude: float = 2, threads: int = 8, info: bool = True, exponent: int = 2, oversample: int = 1, square_tiling: bool = True, check: bool = False, engine: str = 'python', uniform_fill: bool = False, context: RenderContext = None, adaptive: bool = False, adaptive_threshold: float = 1., max_samples: int = None, jitter: bool = False, cache: TileCache = None, out_of_core: bool = False, scratch_dir: str = None, periodicity: bool = False, periodicity_tolerance: float = 0., inexact_sector: bool = False):
+        if engine not in ('python', 'numpy'):
+            raise ValueError(f"'engine' must be 'python' or 'numpy' not {engine!r}")
         self.f = f
         self.c = c
         self.w = width
@@ -26,9 +48,24 @@ class Julia:
         self.threads = threads
         self.exponent = exponent
         self.oversample = oversample
+        self.adaptive = adaptive  # oversample only pixels at edges, see functions.edges
+        self.adaptive_threshold = adaptive_threshold
+        self.max_samples = oversample ** 2 if max_samples is None else min(max_samples, oversample ** 2)
+        self.jitter = jitter
         self.tiling = square_tiling
-
-        self.arr, self.delta, self.elapsed, self.method, self.checked, self.render_area, self.render_areas, self.squares = (None for _ in range(8))
+        self.uniform_fill = uniform_fill  # fill squares with any uniform border iterations, not only 0
+        self.engine = engine
+        self._kernel = None
+        self.stats, self.utilization = Counter(), []
+        self.context = context  # worker pool shared with other renders, otherwise one pool per calculate()
+        self.cache = cache  # raw tiles on disk, reused by re-renders with the same pixels
+        self.out_of_core = out_of_core  # canvas and self.arr memory-mapped to files in scratch_dir
+        self.scratch_dir = scratch_dir
+        self.periodicity = periodicity  # stop orbits that repeat a point as not escaped, see engine.Periodicity
+        self.periodicity_tolerance = periodicity_tolerance  # 0 compares exactly and never changes escaping pixels
+        self.inexact_sector = inexact_sector  # one sector also for rotations that do not map pixels onto pixels or with subpixel offsets, nearest pixels, see rotation.unfold
+
+        self.arr, self.delta, self.elapsed, self.method, self.checked, self.render_area, self.render_areas, self.squares, self.sector = (None for _ in range(9))
         self.check = (self.w + self.h()) / 2 < 3000 and check
 
     def __str__(self):
@@ -64,6 +101,12 @@ class Julia:
             imag = self.imag
         return round(w * abs(self.diff(imag) / self.diff(real)))
     
+    @property
+    def kernel(self) -> kernels.Kernel:  # f compiled for engine='numpy'
+        if self._kernel is None or self._kernel.f is not self.f:
+            self._kernel = kernels.compile_f(self.f)
+        return self._kernel
+
     @property
     def h_mirrored(self):
         im1, im2 = self.imag
@@ -74,23 +117,27 @@ class Julia:
         (re1, re2), (im1, im2) = self.real, self.imag
         return abs(re2) > abs(re1), abs(im1) > abs(im2)
 
-    def get_render_areas(self) -> None:
-        self.sort()
-        re_1, re_2 = self.real
-        im_1, im_2 = self.imag
-        im_long = max(abs(im_1), abs(im_2))
-        if np.sign(im_1) != np.sign(im_2) and np.sign(re_1) != np.sign(re_2):  # cannot exploit symmetry
-            imag = (im_long, 0)
-            if re_1 == -re_2:
-                self.render_areas = [(self.real, imag, 0, (self.w, self.h(imag=imag)))]
-            else:
-                real_2, imag_2 = (re_1, -re_2), (0, -min(abs(im_1), abs(im_2)))
-                h_1 = self.h(imag=imag)
-                w_2 = round(self.w * self.diff(real_2) / self.diff(self.real))
-                self.render_areas = [(self.real, imag, 0, (self.w, h_1)), (real_2, imag_2, h_1, (w_2, self.h(w=w_2, real=real_2, imag=imag_2)))]
-        else:
-            self.render_areas = [(self.real, self.imag, 0, (self.w, self.h()))]
+    @property
+    def rotations(self) -> int:  # order d of the symmetry f(e^(2πi/d)·z, c) = f(z, c), gcd of the powers of z in f, 1 if f is not a polynomial in z plus c
+        coefficients = self.kernel.coefficients
+        if coefficients is None:
+            return 1
+        return math.gcd(*(n for n, a in enumerate(coefficients) if n > 0 and a != 0)) or 1
+
+    def get_render_areas(self) -> None:  # boxes of one sector of the rotational symmetry if they have at least 10% fewer pixels than the view, see rotation
         self.sort()
+        w, h = self.w, self.h()
+        self.render_areas, self.sector = [(self.real, self.imag, 0, (w, h))], None
+        order = self.rotations
+        if order > 1 and not self.inexact_sector:  # the largest rotation that maps pixels onto pixels, subpixel offsets of oversampling are not rotated with them
+            exact = (d for d in (4, 2) if order % d == 0 and rotation.exact(self.real, self.imag, (w, h), d))
+            order = max(exact, default=1) if self.oversample == 1 else 1
+        if order > 1:
+            start, boxes = rotation.sector(self.real, self.imag, (w, h), order)
+            if sum(w_box * h_box for _, (w_box, h_box) in boxes) < 0.9 * w * h:
+                self.render_areas = [((functions.linmap(x0, (0, w), self.real), functions.linmap(x0 + w_box, (0, w), self.real)),
+                                      (functions.linmap(y0, (0, h), self.imag), functions.linmap(y0 + h_box, (0, h), self.imag)), y0, (w_box, h_box)) for (x0, y0), (w_box, h_box) in boxes]
+                self.sector = order, start, boxes
 
     @property
     def type(self) -> str:
@@ -101,22 +148,23 @@ class Julia:
                 return f'Julia; {text.replace(", c", "")}'
         return 'Julia'
 
-    def symmetry(self, arrays: list[np.ndarray, ...]) -> np.ndarray:
+    def symmetry(self, arrays: list[np.ndarray, ...], allocate: Callable = np.zeros) -> np.ndarray:  # whole image in a new array allocate(shape)
         main_arr = arrays[0][0]
-        if len(arrays) == 1:
-            if self.real[0] == -self.real[1]:
-                return np.concatenate((main_arr, main_arr[::-1, ::-1]))
-            else:
-                return main_arr
-        else:
-            arr = np.zeros((self.h(), self.w))
-            for sub_arr, y_offset in arrays:
-                h, w = sub_arr.shape
-                arr[y_offset:y_offset + h, :w] = sub_arr
-            w2, h2 = arrays[1][0].shape
-            arr[y_offset:, w2:] = main_arr[::-1, ::-1][:h2, :self.w - w2]
+        if self.sector is None:
+            arr = allocate(main_arr.shape)
+            arr[...] = main_arr
             return arr
 
+        order, start, boxes = self.sector
+        h, w = self.h(), self.w
+        arr = allocate((h, w))
+        sub_arrays = [sub_arr for sub_arr, _ in arrays]
+        x = np.arange(w)
+        for a, b in stream.row_strips(h, w, 2 ** 18):  # row y is imag growing with y like canvas_arrays, strips flips
+            z = functions.grid2complex(x[None, :], np.arange(a, b)[:, None], self.real, self.imag, (w, h))
+            arr[a:b] = rotation.unfold(sub_arrays, boxes, z, self.real, self.imag, (w, h), order, start)
+        return arr
+
     def sort(self) -> None:
         real, imag = self.real, self.imag
         self.real = real if real[1] > real[0] else real[::-1]
@@ -149,94 +197,121 @@ class Julia:
             squares += self.get_squares(w - w_mod, h_mod, x0, h - h_mod + y0)  # horizontal at bottom
             return squares
 
+    def periodic(self, z: complex) -> Callable[[complex, int], bool] or None:  # cycle check of the orbit starting at z, counts the iterations it saves
+        if not self.periodicity:
+            return None
+        cycle = engine.Periodicity(z, self.periodicity_tolerance)
+
+        def check(z: complex, i: int) -> bool:
+            if cycle(z):
+                self.stats['saved iterations'] += self.max_iterations - i - 1
+                return True
+            return False
+        return check
+
     def calculate_pixel(self, z: complex) -> tuple[complex, int]:
+        periodic = self.periodic(z)
         for i in range(self.max_iterations):
             z = self.f(z=z, c=self.c)
             if abs(z) > self.max_magnitude:
                 for _ in range(self.extra_iterations):
                     z = self.f(z=z, c=self.c)
                 return z, i
+            if periodic and periodic(z, i):
+                break
         return z, 0
 
-    def calculate_square(self, zeros: set, nonzeros: dict, x0: int, y0: int, size: int) -> tuple[dict, list]:
-        # get Δx, Δy
+    def calculate_pixels(self, z: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return engine.escape_time(self.kernel, z, self.c, self.max_iterations, self.extra_iterations, self.max_magnitude, self.periodicity, self.periodicity_tolerance, self.stats)
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # continuous values and iterations of pixels (x, y)
         delta_x, delta_y = self.delta
         real, imag, _, shape = self.render_area
-        if size == 1:
-            if (x0, y0) in nonzeros or (x0, y0) in zeros:
-                return {}, []
-            else:
-                z = functions.xy2complex(x0 + delta_x, y0 + delta_y, real, imag, shape)
-                z, i = self.calculate_pixel(z)
-                return ({}, [((x0, y0), 1)]) if i == 0 else ({(x0, y0): self.continuous(z, i)}, [((x0, y0), 1)])
-
-        zeros, nonzeros, checked = set(), {}, []
-
-        right = [(x0 + size - 1, y0 + i) for i in range(1, size)]
-        top = [(x0 + i, y0) for i in range(1, size)]
-        left = [(x0, y0 + i) for i in range(size - 1)]
-        bottom = [(x0 + i, y0 + size - 1) for i in range(size - 1)]
-
-        for x, y in left + right + top + bottom:
-            z = functions.xy2complex(x + delta_x, y + delta_y, real, imag, shape)
-            z, iterations = self.calculate_pixel(z)
-            if iterations == 0:
-                zeros.update((x, y))
-            else:
-                if self.check:
-                    checked.append(((x0, y0), size))
-                nonzeros.update({(x, y): self.continuous(z, iterations)})
-                break
+        if self.engine == 'numpy':
+            p = functions.grid2complex(x + delta_x, y + delta_y, real, imag, shape)
+            z, i = self.calculate_pixels(p)
+            return engine.smooth(z, i, self.exponent), self.counts(self.kernel, p, i)
+
+        values, iterations = np.zeros(np.shape(x)), np.zeros(np.shape(x), dtype=int)
+        for n, (x_n, y_n) in enumerate(zip(np.ravel(x), np.ravel(y))):
+            p = functions.xy2complex(x_n + delta_x, y_n + delta_y, real, imag, shape)
+            z, i = self.calculate_pixel(p)
+            values.flat[n], iterations.flat[n] = self.continuous(z, i), self.counts(self.f, p, i)
+        return values, iterations
+
+    def start(self, p):  # (z, c) the orbit of pixel p starts from
+        return p, self.c
+
+    def counts(self, f: Callable, p, i):
+        # i = 0 stands for never escaping and for escaping at the first iteration, the first step of f tells them apart and never escaping becomes max_iterations
+        z, c = self.start(p)
+        with np.errstate(over='ignore', invalid='ignore'):
+            return np.where((i == 0) & ~(np.abs(f(z=z, c=c)) > self.max_magnitude), self.max_iterations, i)
+
+    def calculate_block(self, x0: int, y0: int, w: int, h: int) -> np.ndarray:  # square_tiling disabled
+        y, x = np.mgrid[y0:y0 + h, x0:x0 + w]
+        return self.evaluate(x, y)[0]
+
+    def calculate_square(self, x0: int, y0: int, size: int) -> tuple[np.ndarray, list]:
+        fillable = (lambda iterations: np.ones(iterations.shape, dtype=bool)) if self.uniform_fill else (lambda iterations: iterations == self.max_iterations)
+        values, checked, evaluated = tiling.mariani_silver(self.evaluate, x0, y0, size, fillable, self.check)
+        self.stats['evaluated pixels'] += evaluated
+        return values, checked
+
+    def cache_key(self, corner: tuple[int, int], size: int) -> str:  # everything the raw values of a tile depend on
+        real, imag, _, (w, h) = self.render_area
+        (x0, y0), (delta_x, delta_y) = corner, self.delta
+        step = ((Decimal(real[1]) - Decimal(real[0])) / w, (Decimal(imag[1]) - Decimal(imag[0])) / h)
+        origin = (Decimal(real[0]) + Decimal(x0 + delta_x) * step[0], Decimal(imag[0]) + Decimal(y0 + delta_y) * step[1])
+        return self.cache.key(type(self).__name__, self.cache.source(self.f), self.c, self.max_iterations, self.extra_iterations, self.max_magnitude, self.exponent,
+                              self.engine, self.tiling, self.uniform_fill, getattr(self, 'deep_zoom', False), origin, step, size,
+                              *([self.periodicity_tolerance] if self.periodicity and self.periodicity_tolerance else []))
+
+    def render_tile(self, area: int, corner: tuple[int, int], size: int) -> tuple[np.ndarray, list]:  # runs in worker
+        self.render_area = self.render_areas[area]
+        x0, y0 = corner
+        if self.cache is not None and not self.check:
+            key = self.cache_key(corner, size)
+            tile = self.cache.get(key)
+            if tile is not None:
+                self.stats['cache hits'] += 1
+                return tile, []
+            self.stats['cache misses'] += 1
+
+        if self.tiling:
+            tile, checked = self.calculate_square(x0, y0, size)
         else:
-            return nonzeros, checked
-
-        new_size = size // 2
-        northwest = self.calculate_square(zeros, nonzeros, x0, y0, new_size)
-        northeast = self.calculate_square(zeros, nonzeros, x0 + new_size, y0, new_size)
-        southwest = self.calculate_square(zeros, nonzeros, x0, y0 + new_size, new_size)
-        southeast = self.calculate_square(zeros, nonzeros, x0 + new_size, y0 + new_size, new_size)
-        for q_nonzeros, q_checked in [northwest, northeast, southwest, southeast]:
-            nonzeros.update(q_nonzeros)
-            checked += q_checked
-        return nonzeros, checked
-
-    def thread_tiling(self, n: int) -> tuple[np.ndarray, list]:  # thread with square_tiling enabled
-        delta_x, delta_y = self.delta
-        delta_progressbar = 8 + len(str(self.threads))
-        progress_delta, check_n = delta_x + delta_y / self.oversample, self.threads // 2
-
-        one = sum(sum(s[1]**2 for s in squares[n::self.threads]) for squares in self.squares)
-        progress, checked, s = 0, [], time.time()
-
-        arrays = []
-        areas_num = len(self.render_areas)
-        for j, (area, squares) in enumerate(zip(self.render_areas, self.squares)):
-            self.render_area = area
-            y_offset, (w, h) = area[2:]
-
-            squares = squares[n::self.threads]
-            sub_arr = np.zeros((h, w))
-            for (x0, y0), sidelength in squares:
-                pixels, s_checked = self.calculate_square(set(), dict(), x0, y0, sidelength)  # get all pixels that are not in set
-                progress += sidelength ** 2
-                checked += s_checked
-                for (x, y), i in pixels.items():
-                    sub_arr[y, x] = i
-                if self.info and n == check_n:
-                    progress_thread = j / areas_num
-                    progress_area = progress / one
-                    progress_total = progress_delta + (progress_thread + progress_area / areas_num) / self.oversample ** 2
-                    print(f'\r[INFO] calculate | {functions.progressbar(progress_total, delta_progressbar)} | {functions.progressbar(progress_area)} | {self.round(100 * progress_area, 1)}% {self.round(time.time() - s, 2)}s {self.round(progress_area * (time.time() - s) / one, 2)}s', end='')
-            arrays.append((sub_arr, y_offset))
-        progress_total = delta_x + (delta_y + 1/self.oversample)/self.oversample
-
-        arr = self.symmetry(arrays)
-        if self.info and n == check_n:
-            print(f'\r[INFO] calculate | {functions.progressbar(progress_total, delta_progressbar)} | waiting for other threads..{60*" "}', end='')
-        return arr, checked
-    
+            tile, checked = self.calculate_block(x0, y0, size, size), []
+        if self.cache is not None and not self.check:
+            self.cache.put(key, tile)
+        return tile, checked
+
+    def render_pixels(self, area: int, x: np.ndarray, y: np.ndarray) -> np.ndarray:  # runs in worker
+        self.render_area = self.render_areas[area]
+        return self.evaluate(x, y)[0]
+
+    def canvas_shape(self) -> tuple[int, int]:  # render areas stacked vertically
+        return sum(area[3][1] for area in self.render_areas), max(area[3][0] for area in self.render_areas)
+
+    def canvas_arrays(self, arr: np.ndarray) -> list[tuple[np.ndarray, int]]:
+        arrays, row = [], 0
+        for _, _, y_offset, (w, h) in self.render_areas:
+            arrays.append((arr[row:row + h, :w], y_offset))
+            row += h
+        return arrays
+
+    def write_tile(self, arr: np.ndarray, area: int, corner: tuple[int, int], size: int, result: tuple[np.ndarray, list], locks: list) -> list:  # runs in worker, squares never overlap
+        (x0, y0), (tile, checked) = corner, result
+        y0 += sum(h for _, _, _, (_, h) in self.render_areas[:area])
+        arr[y0:y0 + size, x0:x0 + size] += tile
+        if self.sector is not None:  # checked squares in view pixels, a box of the sector starts at its first pixel
+            (box_x, box_y), _ = self.sector[2][area]
+            checked = [((x + box_x, y + box_y), size) for (x, y), size in checked]
+        return checked
+
     def _calculate(self, size_offset: int):
         self.checked = []
+        self.stats = Counter()
 
         self.get_render_areas()
         self.squares = []
@@ -248,80 +323,185 @@ class Julia:
         self._calculate(size_offset)
         
         if self.info:
-            print(f'[INFO] calculate | {self.threads} threads | size = (w={self.w}, h={self.h() + abs(self.h_mirrored)}) | iterations = {self.max_iterations}')
+            print(f'[INFO] calculate | {self.threads} threads | size = (w={self.w}, h={self.h() + abs(self.h_mirrored)}) | iterations = {self.max_iterations}' + (f' | {self.kernel!r}' if self.engine == 'numpy' else ''))
 
-        pool = Pool(self.threads)
+        context = self.context or RenderContext(self.threads)
+        context.open()
         s = time.time()
-        for delta_x in range(self.oversample):
-            for delta_y in range(self.oversample):
-                self.delta = (delta_x/self.oversample, delta_y/self.oversample)
-                pool_map = pool.map(self.thread_tiling, range(self.threads))
-                if self.arr is None:
-                    self.arr = sum(t[0] for t in pool_map)
-                else:
-                    self.arr += sum(t[0] for t in pool_map)
-                if self.info:
-                    print(f'\r[INFO] calculate | {functions.progressbar(self.delta[0] + (self.delta[1] + 1/self.oversample)/self.oversample, 8 + len(str(self.threads)))} | adding arrays from threads' + 60*' ', end='')
-                if self.check:
-                    for t in pool_map:
-                        self.checked += t[1]
+        jobs = scheduler.plan(self, context.threads)
+        costs, busy = {job[1:]: job[0] for job in jobs}, Counter()
+        one, delta_progressbar = sum(costs.values()) or 1, 8 + len(str(context.threads))
+        shared = MappedCanvas(self.canvas_shape(), directory=self.scratch_dir) if self.out_of_core else SharedCanvas(self.canvas_shape())
+        with shared, context.publish(self) as key:
+            offsets = self.offsets()
+            for n, self.delta in enumerate(offsets):
+                progress_delta, progress = n / len(offsets), 0
+                for job, checked, stats, pid, elapsed in context.imap(scheduler.work, [(key, self.delta, *job[1:], shared.spec) for job in jobs]):
+                    self.checked += checked
+                    self.stats.update(stats)
+                    busy[pid] += elapsed
+                    if self.info:
+                        progress += costs[job] / one
+                        print(f'\r[INFO] calculate | {functions.progressbar(progress_delta + progress / len(offsets), delta_progressbar)} | {functions.progressbar(progress)} | {self.round(100 * progress, 1)}% {self.round(time.time() - s, 2)}s', end='')
+            if self.adaptive:
+                self.supersample(context, key, shared.arr, busy)
+            arr = self.symmetry(self.canvas_arrays(shared.arr), (lambda shape: canvas.memmap(shape, self.scratch_dir)) if self.out_of_core else np.zeros)
+            if self.arr is None:
+                self.arr = arr
+            else:
+                self.arr += arr
+            del arr
         self.elapsed = time.time() - s
-        pool.close()
+        if self.context is None:
+            context.close()
+        self.utilization = scheduler.utilization(busy, context.threads, self.elapsed)
 
         if self.info:
             print(f'\r[INFO] calculate | finished in {round(self.elapsed, 2)}s' + 60*' ')
+            print(f'[INFO] calculate | utilization = {", ".join(f"{round(100 * u)}%" for u in self.utilization)}')
+            if self.stats:
+                print(f'[INFO] calculate | {", ".join(f"{key} = {value}" for key, value in self.stats.items())}')
         return self.elapsed
 
-    def normalize_arr(self, arr: np.ndarray, depth: int, percentile: float) -> np.ndarray:
-        if arr.max() == 0.0:
+    def offsets(self) -> list[tuple[float, float]]:  # subpixel offsets of the oversampled passes
+        if self.adaptive:
+            return [(0., 0.)]
+        return [(delta_x/self.oversample, delta_y/self.oversample) for delta_x in range(self.oversample) for delta_y in range(self.oversample)]
+
+    def render(self, size_offset: int = 0) -> np.ndarray:  # whole image in this process without a pool, e.g. one video frame in a worker, see calculate
+        self._calculate(size_offset)
+        arr, locks = np.zeros(self.canvas_shape()), [Lock()]
+        jobs = scheduler.plan(self, self.threads)  # the squares of calculate, tiling fills squares differently when they are split
+        for self.delta in self.offsets():
+            for _, area, corner, size in jobs:
+                self.checked += self.write_tile(arr, area, corner, size, self.render_tile(area, corner, size), locks)
+        if self.adaptive:
+            self.supersample(None, None, arr, Counter())
+        return self.symmetry(self.canvas_arrays(arr))
+
+    def frame(self, job: tuple[complex, int]) -> np.ndarray:  # (c, size_offset) -> image, see render and video.JuliaVideo
+        self.c, size_offset = job
+        return self.render(size_offset)
+
+    def frame_statistics(self, job: tuple[complex, int, float]) -> tuple[float, float, float or None] or None:  # (c, size_offset, percentile) -> tonemap.statistics of the image, None if it is black
+        c, size_offset, percentile = job
+        arr = self.frame((c, size_offset))
+        return tonemap.statistics(arr, percentile) if arr.any() else None
+
+    def supersample(self, context: RenderContext or None, key: tuple[str, int], arr: np.ndarray, busy: Counter, chunk_size: int = 4096) -> None:
+        # add up to max_samples - 1 stratified samples at edge pixels, scaled like uniform oversampling, in this process if context is None
+        o = self.oversample
+        offsets = [(delta_x/o, delta_y/o) for delta_x in range(o) for delta_y in range(o)][1:]
+        if self.max_samples - 1 < len(offsets):
+            offsets = [offsets[round(i)] for i in np.linspace(0, len(offsets) - 1, self.max_samples - 1)]
+        if self.jitter:
+            rng = np.random.default_rng(0)
+            offsets = [(delta_x + rng.uniform(0, 1/o), delta_y + rng.uniform(0, 1/o)) for delta_x, delta_y in offsets]
+
+        jobs, edges = [], []
+        for j, (sub_arr, _) in enumerate(self.canvas_arrays(arr)):
+            y, x = functions.edge_pixels(sub_arr, self.adaptive_threshold)
+            edges.append((y, x, np.zeros((len(offsets), len(y)))))  # summed in a fixed order, results come in any order
+            for chunk in range(0, len(y), chunk_size):
+                jobs += [(key, delta, j, (n, chunk), x[chunk:chunk + chunk_size], y[chunk:chunk + chunk_size]) for n, delta in enumerate(offsets)]
+
+        def serial() -> Iterator[tuple]:  # like scheduler.work_pixels
+            for _, self.delta, j, chunk, x, y in jobs:
+                yield j, chunk, self.render_pixels(j, x, y), Counter(), os.getpid(), 0.
+
+        for j, (n, chunk), values, stats, pid, elapsed in serial() if context is None else context.imap(scheduler.work_pixels, jobs):
+            edges[j][2][n, chunk:chunk + len(values)] = values
+            self.stats.update(stats)
+            busy[pid] += elapsed
+
+        for (sub_arr, _), (y, x, samples) in zip(self.canvas_arrays(arr), edges):
+            refined = (sub_arr[y, x] + samples.sum(axis=0)) * o ** 2 / (len(offsets) + 1)
+            for a, b in stream.row_strips(*sub_arr.shape):
+                sub_arr[a:b] *= o ** 2
+            sub_arr[y, x] = refined
+            self.stats['supersampled pixels'] += samples.shape[1]
+
+    def normalization(self, arr: np.ndarray, percentile: float, tone: str = 'asinh') -> Callable[[np.ndarray], np.ndarray]:  # tone map of a strip of arr, see tonemap
+        bounds = stream.minmax(arr)
+        if bounds[1] == 0.0:
             raise NoDataException
-        if percentile == 0.0:
-            arr /= arr.max()
-        else:
-            arr = functions.asinh_stretch(arr, percentile)
+        return tonemap.normalization(arr, percentile, tone, bounds)
 
+    def strips(self, arr: np.ndarray, normalize: Callable[[np.ndarray], np.ndarray]) -> Iterator[np.ndarray]:  # normalized rows from top to bottom of the flipped image
         lr, ud = self.flip
-        if lr:
-            arr = np.fliplr(arr)
-        if ud:
-            arr = np.flipud(arr)
-        return arr
+        h, w = arr.shape
+        for a, b in stream.row_strips(h, w):
+            strip = normalize(arr[h - b:h - a][::-1] if ud else arr[a:b])
+            yield np.fliplr(strip) if lr else strip
+
+    def normalize_arr(self, arr: np.ndarray, depth: int, percentile: float, tone: str = 'asinh') -> np.ndarray:
+        return np.concatenate(list(self.strips(arr, self.normalization(arr, percentile, tone))))
+
+    def colorized(self, percentile: float, tone: str, palette: Gradient = None) -> Iterator[np.ndarray]:  # normalized strips, BGR if palette is given
+        if palette is not None and palette.cyclic:
+            samples = self.oversample ** 2  # arr sums that many passes, also with adaptive, see supersample
+            strips = self.strips(self.arr, lambda strip: np.array(strip, dtype=float) / samples)
+        else:
+            strips = self.strips(self.arr, self.normalization(self.arr, percentile, tone))
+        return strips if palette is None else map(palette, strips)
 
-    def show(self, percentile: float = 3.):
-        arr = self.normalize_arr(self.arr, 8, percentile)
+    def show(self, percentile: float = 3., tone: str = 'asinh', palette: Gradient = None):
+        arr = np.concatenate(list(self.colorized(percentile, tone, palette)))
         arr *= 255/arr.max()
         cv2.imshow(repr(self), arr.astype(np.uint8))
         if self.info:
             print('[INFO] show')
         cv2.waitKey(0)
 
-    def save(self, filename: str = None, depth: int = 16, percentile: float = 3., boxes: float = 0.):
+    def overlay(self, strips: Iterator[np.ndarray], boxes: float) -> Iterator[np.ndarray]:  # self.checked blended into the strips, see functions.boxes2arr
+        start = time.time()
+        h, w = self.arr.shape
+        lr, ud = self.flip
+        checked = [((w - x - size if lr else x, h - y - size if ud else y), size) for (x, y), size in self.checked]  # flipped like the strips
+        bounds = list(stream.row_strips(h, w))
+        peak = max((strip.max() for strip in functions.box_strips(w, h, checked, bounds)), default=0.)
+        if peak == 0.0:
+            raise NoDataException
+        if self.info:
+            print(f'[INFO] boxes2arr | finished in {round(time.time() - start, 2)}s')
+
+        for strip, box_strip in zip(strips, functions.box_strips(w, h, checked, bounds)):
+            strip *= 1 - boxes
+            strip += boxes / peak * (box_strip if strip.ndim == 2 else box_strip[..., None])
+            yield strip
+
+    def save(self, filename: str = None, depth: int = 16, percentile: float = 3., boxes: float = 0., extension: str = '.png', tone: str = 'asinh', palette: Gradient = None):  # written strip by strip, see writer
         if filename is None:
             filename = str(self)
         dtype = np.uint8 if depth == 8 else np.uint16 if depth == 16 else None
         if dtype is None:
             raise ValueError(f"'depth' must be 8 or 16 not {depth}")
 
-        img_arr = self.normalize_arr(self.arr, depth, percentile)
-        if boxes == 0.:
-            img_arr *= 2 ** depth - 1
-        else:
-            start = time.time()
-            boxes_arr = functions.boxes2arr(self.w, self.h(), self.checked, self.info)
-            if self.info:
-                print(f'\r[INFO] boxes2arr | finished in {round(time.time() - start, 2)}s')
-            boxes_arr = self.normalize_arr(boxes_arr, depth, 0.0)
-            img_arr = (1 - boxes) * img_arr + boxes * boxes_arr
-            img_arr *= 2 ** depth - 1
+        strips = self.colorized(percentile, tone, palette)
+        if boxes != 0.:
+            strips = self.overlay(strips, boxes)
             filename += f'; b{round(100 * boxes)}'
-        cv2.imwrite(f'{filename}.png', img_arr.astype(dtype))
+
+        with writer.writer(f'{filename}{extension}', self.arr.shape, dtype, 1 if palette is None else 3) as image:
+            for strip in strips:
+                strip *= 2 ** depth - 1
+                image.write(strip.astype(dtype))
         if self.info:
-            print(f"[INFO] saved to '{filename}.png'")
+            print(f"[INFO] saved to '{filename}{extension}'")
 
 
 class Mandelbrot(Julia):
-    def __init__(self, f: Callable, *args, **kwargs):
+    def __init__(self, f: Callable, *args, deep_zoom: bool = False, bulbs: int = 2, **kwargs):
         super().__init__(f, None, *args, **kwargs)
+        if bulbs < 0:
+            raise ValueError(f"'bulbs' must not be negative not {bulbs}")
+        self.deep_zoom = deep_zoom  # perturbation against a high-precision reference orbit, bounds may be Decimal
+        self.references = None
+        self.orbit = None  # reference orbit reused by renders of views with the same center, see video.MandelbrotZoom
+        self.bulbs = bulbs  # c in components up to this period are interior without iterating, see engine.interior
+        self.disks = engine.bulb_disks(bulbs) if bulbs > 2 else None
+        if deep_zoom:
+            self.engine = 'numpy'
 
     @property
     def type(self) -> str:
@@ -344,33 +524,86 @@ class Mandelbrot(Julia):
             self.render_areas = [(self.real, self.imag, 0, (self.w, self.h()))]
         self.sort()
 
+    @property
+    def quadratic(self) -> bool:  # f(z, c) = z ** 2 + c
+        kernel = self.kernel
+        return kernel.method == 'power' and kernel.degree == 2 and kernel.c_coefficient == 1
+
+    def interior(self, c: np.ndarray) -> np.ndarray or None:  # c known to be in the set without iterating, None if not applicable
+        if self.bulbs == 0 or self.deep_zoom or not self.quadratic:
+            return None
+        return engine.interior(c, self.disks)
+
     def calculate_pixel(self, c: complex) -> tuple[complex, int]:
         z = 0
+        if self.interior(c):
+            self.stats['pre-rejected pixels'] += 1
+            return z, 0
+        periodic = self.periodic(z)
         for i in range(self.max_iterations):
             z = self.f(z=z, c=c)
             if abs(z) > self.max_magnitude:
                 for _ in range(self.extra_iterations):
                     z = self.f(z=z, c=c)
                 return z, i
+            if periodic and periodic(z, i):
+                break
         return z, 0
 
-    def symmetry(self, arrays: list[np.ndarray]) -> np.ndarray:
+    def calculate_pixels(self, c: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        interior = self.interior(c)
+        if interior is None or not interior.any():
+            return engine.escape_time(self.kernel, np.zeros_like(c), c, self.max_iterations, self.extra_iterations, self.max_magnitude, self.periodicity, self.periodicity_tolerance, self.stats)
+        self.stats['pre-rejected pixels'] += int(np.count_nonzero(interior))
+        z, i, outside = np.zeros_like(c, dtype=complex), np.zeros(np.shape(c), dtype=int), ~interior
+        z[outside], i[outside] = engine.escape_time(self.kernel, np.zeros(np.count_nonzero(outside), dtype=complex), c[outside], self.max_iterations, self.extra_iterations, self.max_magnitude,
+                                                    self.periodicity, self.periodicity_tolerance, self.stats)
+        return z, i
+
+    def start(self, c):
+        return 0 * c, c
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if not self.deep_zoom:
+            return super().evaluate(x, y)
+        delta_x, delta_y = self.delta
+        reference = self.references[self.render_areas.index(self.render_area)]
+        dc = reference.delta_c(x + delta_x, y + delta_y)
+        z, i, stats = reference.escape_time(self.kernel, dc, self.max_iterations, self.extra_iterations, self.max_magnitude)
+        self.stats.update(stats)
+        return engine.smooth(z, i, self.exponent), self.counts(self.kernel, complex(float(reference.center[0]), float(reference.center[1])) + dc, i)
+
+    def _calculate(self, size_offset: int):
+        super()._calculate(size_offset)
+        if self.deep_zoom:
+            if self.kernel.method != 'power' or self.kernel.c_coefficient != 1:
+                raise ValueError(f"'deep_zoom' requires f(z, c) = z ** n + c not {self.kernel!r}")
+            self.references = [perturbation.Reference(real, imag, shape, self.kernel.degree, self.max_iterations, self.max_magnitude, orbit=self.orbit) for real, imag, _, shape in self.render_areas]
+            if self.info:
+                print(f'[INFO] reference | precision = {self.references[0].precision} digits | skipped iterations = {self.references[0].skip}')
+
+    def symmetry(self, arrays: list[np.ndarray], allocate: Callable = np.zeros) -> np.ndarray:
         imag = self.render_areas[0][1]
         main_arr = arrays[0][0]
         if self.imag[0] == -self.imag[1]:
-            return np.concatenate((main_arr, main_arr[::-1, ]))
+            mirrored = main_arr[::-1, ]
         elif np.sign(self.imag[0]) + np.sign(self.imag[1]) == 0:
-            return np.concatenate((main_arr, main_arr[::-1, ][:self.h_mirrored, ]))
+            mirrored = main_arr[::-1, ][:self.h_mirrored, ]
         else:
-            return main_arr
+            mirrored = main_arr[:0]
+        h, w = main_arr.shape
+        arr = allocate((h + len(mirrored), w))
+        arr[:h], arr[h:] = main_arr, mirrored
+        return arr
 
         
 class Nebulabrot(Mandelbrot):
     def __init__(self, f: Callable, k: int = 0, *args, anti: bool = False, **kwargs):
         super().__init__(f, *args, **kwargs)
+        if self.adaptive:
+            raise ValueError(f"'adaptive' oversampling is not supported by {type(self).__name__}")
         self.k = k
-        self.anti = anti
-        self.pixels: list[set, int]
+        self.anti = anti  # orbits of starting points that never leave, periodic ones shortcut by orbits.follow(cycles=True)
 
     @property
     def type(self) -> str:
@@ -378,56 +611,42 @@ class Nebulabrot(Mandelbrot):
         for line in lines:
             if line.find('return') != -1:
                 text = f"{lines[0][4:-1]} = {line.replace('    ', '')[7:].replace('**', '^').replace('*', '·')}"
-                return f"Buddhabrot; {text}"
-        return 'Buddhabrot'
+                return f"{'Antibuddhabrot' if self.anti else 'Buddhabrot'}; {text}"
+        return 'Antibuddhabrot' if self.anti else 'Buddhabrot'
+
+    def interior(self, c: np.ndarray) -> np.ndarray or None:  # orbits of the set stay in |z| <= 2, so they only never leave views containing that disk
+        if not (self.real[0] <= -2 and self.real[1] >= 2 and self.imag[0] <= -2 and self.imag[1] >= 2):
+            return None
+        return super().interior(c)
 
-    def calculate_square(self, pixels: set, not_pixels: set, x0: int, y0: int, size: int) -> set:
-        # get Δx, Δy
+    def inside(self, z: np.ndarray) -> np.ndarray:  # vectorized box test of calculate_pixel
+        return (self.real[0] < z.real) & (z.real < self.real[1]) & (self.imag[0] < z.imag) & (z.imag < self.imag[1])
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:  # 1 for selected starting points
         delta_x, delta_y = self.delta
         real, imag, _, shape = self.render_area
-        if size == 1:
-            if (x0, y0) in pixels or (x0, y0) in not_pixels:
-                return set()
-            else:
-                z = functions.xy2complex(x0 + delta_x, y0 + delta_y, real, imag, shape)
-                z, i = self.calculate_pixel(z)
-                return {(x0, y0)} if (i == 0 and self.anti) or (i != 0 and not self.anti) else set()
-
-        right = [(x0 + size - 1, y0 + i) for i in range(1, size)]
-        top = [(x0 + i, y0) for i in range(1, size)]
-        left = [(x0, y0 + i) for i in range(size - 1)]
-        bottom = [(x0 + i, y0 + size - 1) for i in range(size - 1)]
-
-        for x, y in left + right + top + bottom:
-            if (x, y) in pixels:
-                continue
-            elif (x, y) in not_pixels:
-                break
-            else:
-                z = functions.xy2complex(x + delta_x, y + delta_y, real, imag, shape)
-                z, iterations = self.calculate_pixel(z)
-                # if (iterations == 0 and self.anti) or (iterations != 0 and not self.anti):
-                if self.k < iterations:
-                    pixels.update({(x, y)})
-                else:
-                    not_pixels.update({(x, y)})
-                    break
+        c = functions.grid2complex(np.ravel(x) + delta_x, np.ravel(y) + delta_y, real, imag, shape)
+        i, interior = np.full(c.size, self.max_iterations), self.interior(c)
+        if interior is not None:
+            self.stats['pre-rejected pixels'] += int(np.count_nonzero(interior))
+            c = c[~interior]
+        i[slice(None) if interior is None else ~interior] = orbits.exits(self.kernel, c, self.max_iterations, self.inside, periodicity=self.periodicity or self.anti,
+                                                                          tolerance=self.periodicity_tolerance if self.periodicity else 0., stats=self.stats)
+        if self.anti:
+            selected = i == self.max_iterations
         else:
-            for x in range(size):
-                for y in range(size):
-                    pixels.update({(x + x0, y + y0)})
-            return pixels
-
-        new_size = size // 2
-        northwest = self.calculate_square(pixels, not_pixels, x0, y0, new_size)
-        northeast = self.calculate_square(pixels, not_pixels, x0 + new_size, y0, new_size)
-        southwest = self.calculate_square(pixels, not_pixels, x0, y0 + new_size, new_size)
-        southeast = self.calculate_square(pixels, not_pixels, x0 + new_size, y0 + new_size, new_size)
-        for q_pixels in [northwest, northeast, southwest, southeast]:
-            pixels.update(q_pixels)
-        return pixels
+            selected = (self.k < i) & (i < self.max_iterations)  # calculate_pixel returns i = 0 if the orbit stays
+        selected = selected.reshape(np.shape(x)).astype(int)
+        return selected.astype(float), selected
+
+    def calculate_square(self, x0: int, y0: int, size: int) -> np.ndarray:
+        values, _, evaluated = tiling.mariani_silver(self.evaluate, x0, y0, size, lambda selected: selected == 1)
+        self.stats['evaluated pixels'] += evaluated
+        return values != 0
 
     def _calculate(self, size_offset: int):
+        self.checked = []
+        self.stats = Counter()
         self.get_render_areas()
         self.squares = []
         for area in self.render_areas:
@@ -436,62 +655,49 @@ class Nebulabrot(Mandelbrot):
 
     def calculate_pixel(self, c: complex) -> tuple[complex, int]:
         z = 0
+        if self.interior(c):
+            self.stats['pre-rejected pixels'] += 1
+            return z, 0
+        periodic = self.periodic(z)
         for i in range(self.max_iterations):
             z = self.f(z=z, c=c)
             if not (self.real[0] < z.real < self.real[1] and self.imag[0] < z.imag < self.imag[1]):
                 return z, i
+            if periodic and periodic(z, i):
+                break
         return z, 0
 
-    def calculate_thread(self, n: int) -> tuple[np.ndarray, list]:  # thread with square_tiling enabled
+    def render_tile(self, area: int, corner: tuple[int, int], size: int) -> tuple[np.ndarray, np.ndarray]:  # runs in worker
+        self.render_area = self.render_areas[area]
+        real, imag, y_offset, (w, h) = self.render_area
         delta_x, delta_y = self.delta
-        delta_progressbar = 8 + len(str(self.threads))
-        progress_delta, check_n, len_render_areas = delta_x + delta_y / self.oversample, self.threads // 2, len(self.render_areas)
-
-        progress, one1 = 0, sum(sum(s[1]**2 for s in squares[n::self.threads]) for squares in self.squares)
-
-        arrays, arr_h = [], self.h()
-        for i, (area, squares) in enumerate(zip(self.render_areas, self.squares)):
-            progress_thread = i / len_render_areas
-            self.render_area = area
-            real, imag, y_offset, (w, h) = area
-            pixels = set()
-
-            # get pixels not in set
-            one, s = sum(s[1]**2 for s in squares[n::self.threads]), time.time()
-            for (x0, y0), sidelength in squares[n::self.threads]:
-                s_pixels = self.calculate_square(set(), set(), x0, y0, sidelength)  # get all pixels that are not in set
-                pixels.update(s_pixels)
-                if self.info and n == check_n:
-                    progress += sidelength ** 2
-                    progress_area = progress / one
-                    progress_total = progress_delta + (
-                                progress_thread + progress_area / len_render_areas) / self.oversample ** 2
-                    print(f'\r[INFO] calculate | {functions.progressbar(progress_total, delta_progressbar)} | {functions.progressbar(progress_area)} | {self.round(100 * progress_area, 1)}% {self.round(time.time() - s, 2)}s {self.round(progress_area * (time.time() - s) / one, 2)}s', end='')
-
-            # follow pixel
-            sub_arr, one2, s2 = np.zeros((arr_h, self.w)), len(pixels), time.time()
-            for k, (x, y) in enumerate(pixels):
-                z, c = 0, functions.xy2complex(x + delta_x, y + delta_y + y_offset, real, imag, (w, h))
-                for _ in range(self.max_iterations):
-                    z = self.f(z=z, c=c)
-                    j, i = functions.complex2yx(z, self.real, self.imag, (self.w, arr_h))
-                    if 0 <= i < self.w and 0 <= j < arr_h:
-                        sub_arr[j, i] += 1
-                    else:
-                        break
+        x0, y0 = corner
+        arr_h = self.h()
 
-            arrays.append((sub_arr, y_offset))
-        arr = self.symmetry(arrays)
+        # selected starting points of the square
+        s_y, s_x = np.nonzero(self.calculate_square(x0, y0, size))
+        c = functions.grid2complex(s_x + x0 + delta_x, s_y + y0 + delta_y + y_offset, real, imag, (w, h))
 
-        if self.info and n == check_n:
-            print(f'\r[INFO] calculate | {functions.progressbar(delta_x + (delta_y + 1/self.oversample)/self.oversample, delta_progressbar)} | waiting for other threads..{60*" "}', end='')
-        return arr, []
+        # orbits until their first point out of view
+        return orbits.hits(self.kernel, c, np.full(c.size, self.max_iterations), self.real, self.imag, (self.w, arr_h), until_outside=True, cycles=self.anti, stats=self.stats)
 
-    def symmetry(self, arrays: list[np.ndarray]) -> np.ndarray:
+    def canvas_shape(self) -> tuple[int, int]:  # one histogram for all starting points
+        return self.h(), self.w
+
+    def canvas_arrays(self, arr: np.ndarray) -> list[tuple[np.ndarray, int]]:
+        return [(arr, 0)]
+
+    def write_tile(self, arr: np.ndarray, area: int, corner: tuple[int, int], size: int, result: tuple[np.ndarray, np.ndarray], locks: list) -> list:  # runs in worker, orbits of all tiles overlap
+        canvas.add_locked(arr, *result, locks)
+        return []
+
+    def symmetry(self, arrays: list[np.ndarray], allocate: Callable = np.zeros) -> np.ndarray:
         imag = self.render_areas[0][1]
         main_arr = arrays[0][0]
         if self.imag[0] == -self.imag[1]:
-            return main_arr + main_arr[::-1, ]
+            arr = allocate(main_arr.shape)
+            np.add(main_arr, main_arr[::-1, ], out=arr)
+            return arr
         else:
             raise RangeError(f'invalid range for {type(self)}: real = {self.real}, imag = {self.imag}')
 
@@ -0,0 +1,194 @@
+from collections import Counter
+import numpy as np
+from typing import Callable
+
+import engine
+import functions
+
+
+def in_view(z: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int]) -> np.ndarray:  # 0 <= x < w and 0 <= y < h of functions.complex2yx
+    w, h = shape
+    x, y = functions.linmap(z.real, real, (0, w)), functions.linmap(z.imag, imag, (0, h))
+    with np.errstate(invalid='ignore'):  # round half to even: -0.5 -> 0 and w - 0.5 -> w - 1 only for odd w
+        return (x >= -0.5) & ((x <= w - 0.5) if w % 2 else (x < w - 0.5)) & (y >= -0.5) & ((y <= h - 0.5) if h % 2 else (y < h - 0.5))
+
+
+def pixels(z: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int]) -> np.ndarray:  # flat pixel indices of points in view
+    w, h = shape
+    y, x = np.rint(functions.linmap(z.imag, imag, (0, h))), np.rint(functions.linmap(z.real, real, (0, w)))
+    return (y * w + x).astype(np.int64)
+
+
+def run(f: Callable, samples: np.ndarray, c: np.ndarray, visit: Callable, refill: Callable) -> None:
+    '''orbits 0 -> f(z, c) -> ... of c[j] for sample ids samples[j] as arrays
+    visit(samples, iterations, z) gets point number iterations (from 0) of the orbits and returns which are finished,
+    refill(finished samples) returns (samples, c) of new orbits, at most as many, that take over the finished slots'''
+    samples, c = np.array(samples), np.array(c, dtype=complex)
+    z, iterations = np.zeros(samples.size, dtype=complex), np.zeros(samples.size, dtype=np.int64)
+    with np.errstate(over='ignore', invalid='ignore'):
+        while samples.size:
+            z = f(z=z, c=c)
+            done = np.flatnonzero(visit(samples, iterations, z))
+            iterations += 1
+            if done.size:
+                new_samples, new_c = refill(samples[done])
+                refilled, dropped = done[:new_samples.size], done[new_samples.size:]
+                samples[refilled], z[refilled], c[refilled], iterations[refilled] = new_samples, 0, new_c, 0
+                if dropped.size:
+                    keep = np.ones(samples.size, dtype=bool)
+                    keep[dropped] = False
+                    samples, z, c, iterations = samples[keep], z[keep], c[keep], iterations[keep]
+
+
+def iterate(f: Callable, c: np.ndarray, visit: Callable, batch: int = 4096, progress: Callable = None) -> None:
+    # run over all c, batch of them at a time so that every step works on full arrays, progress(fraction of c started) after every refill
+    c = np.ravel(c)
+    following = min(batch, c.size)
+
+    def refill(finished: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        nonlocal following
+        new = np.arange(following, min(following + finished.size, c.size))
+        following += new.size
+        if progress is not None and new.size:
+            progress(following / c.size)
+        return new, c[new]
+
+    run(f, np.arange(following), c[:following], visit, refill)
+
+
+def exits(f: Callable, c: np.ndarray, n: int, inside: Callable, batch: int = 4096, progress: Callable = None,
+          periodicity: bool = False, tolerance: float = 0., stats: Counter = None) -> np.ndarray:
+    '''iteration at which the orbit of each c first leaves inside(z) (e.g. in_view), n if it stays for n iterations
+    with periodicity, orbits that repeat a saved point (see engine.Periodicity) stay without being iterated further, stats['saved iterations'] counts the skipped iterations'''
+    left_at = np.full(np.size(c), n)
+    saved = np.zeros(np.size(c), dtype=complex) if periodicity else None  # orbits start at 0
+
+    def visit(samples: np.ndarray, iterations: np.ndarray, z: np.ndarray) -> np.ndarray:
+        left = ~inside(z)
+        left_at[samples[left]] = iterations[left]
+        done = left | (iterations >= n - 1)
+        if periodicity:
+            trapped = ~done & engine.cycled(z, saved[samples], tolerance)
+            if stats is not None:
+                stats['saved iterations'] += int((n - 1 - iterations[trapped]).sum())
+            save = ((iterations + 1) & (iterations + 2)) == 0  # after 1, 3, 7, 15, ... iterations like engine.Periodicity
+            saved[samples[save]] = z[save]
+            done |= trapped
+        return done
+
+    if n > 0:
+        iterate(f, c, visit, batch, progress)
+    return left_at
+
+
+def contributions(f: Callable, c: np.ndarray, n: int, selected: Callable, inside: Callable, real: tuple, imag: tuple, shape: tuple[int, int], batch: int = 4096) -> tuple[np.ndarray, np.ndarray]:
+    # (exits, number of points in view before the exit) of each c, no points unless selected(exits), e.g. k < exit < n
+    left_at, hits = np.full(np.size(c), n), np.zeros(np.size(c), dtype=np.int64)
+
+    def visit(samples: np.ndarray, iterations: np.ndarray, z: np.ndarray) -> np.ndarray:
+        left = ~inside(z)
+        left_at[samples[left]] = iterations[left]
+        hits[samples[~left]] += in_view(z[~left], real, imag, shape)
+        return left | (iterations >= n - 1)
+
+    if n > 0:
+        iterate(f, c, visit, batch)
+    hits[~selected(left_at)] = 0
+    return left_at, hits
+
+
+def follow(f: Callable, c: np.ndarray, left_at: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int], flush: Callable, batch: int = 4096, buffer_size: int = 2 ** 20,
+           progress: Callable = None, weights: np.ndarray = None, channels: np.ndarray = None, until_outside: bool = False, cycles: bool = False, stats: Counter = None) -> int:
+    '''points of every orbit in view before iteration left_at (see exits), and before its first point out of view if until_outside,
+    collected as flat pixel indices in a preallocated buffer and handed to flush(indices, weights or None), returns the number of points
+    with channels, a bool (orbits, channels) array, every point is repeated for every channel of its orbit, offset by channel · w · h
+    with cycles, an orbit that exactly repeats a saved point (see engine.Periodicity) is iterated for one more period only,
+    its points weighted by how often the remaining iterations up to left_at visit them, stats['saved iterations'] counts the skipped iterations'''
+    left_at = np.ravel(left_at)
+    layer = shape[0] * shape[1]
+    weighted = weights is not None or cycles
+    buffer, fill, total = np.empty(buffer_size, dtype=np.int64), 0, 0
+    point_weights = np.empty(buffer_size) if weighted else None
+    if cycles:  # orbits start at 0, the point of iteration -1
+        saved, saved_at = np.zeros(left_at.size, dtype=complex), np.full(left_at.size, -1)
+        detected, period = np.full(left_at.size, -1), np.zeros(left_at.size, dtype=np.int64)
+
+    def visit(samples: np.ndarray, iterations: np.ndarray, z: np.ndarray) -> np.ndarray:
+        nonlocal fill, total
+        end = left_at[samples]
+        recorded = iterations < end
+        if cycles:  # point m of the period after the detection is visited count times by the remaining iterations
+            cycling = detected[samples] >= 0
+            d, p = detected[samples][cycling], period[samples][cycling]
+            m, remaining = iterations[cycling] - d - 1, end[cycling] - 1 - d
+            count = np.ones(samples.size, dtype=np.int64)
+            count[cycling] = remaining // p + (m < remaining % p)
+        view = np.zeros(samples.size, dtype=bool)
+        view[recorded] = in_view(z[recorded], real, imag, shape)
+        index, points = pixels(z[view], real, imag, shape), samples[view]
+        weight = None
+        if weighted:
+            weight = count[view] if cycles else np.ones(index.size)
+            if weights is not None:
+                weight = weight * weights[points]
+        if channels is not None:  # one point per channel of its orbit
+            point, channel = np.nonzero(channels[points])
+            index, points = index[point] + layer * channel, points[point]
+            weight = None if weight is None else weight[point]
+        if fill + index.size > buffer_size:
+            flush(buffer[:fill], point_weights[:fill] if weighted else None)
+            total, fill = total + fill, 0
+        if index.size > buffer_size:
+            flush(index, weight)
+            total += index.size
+        else:
+            buffer[fill:fill + index.size] = index
+            if weighted:
+                point_weights[fill:fill + index.size] = weight
+            fill += index.size
+
+        done = (iterations + 1 >= end) | (recorded & ~view) if until_outside else iterations + 1 >= end
+        if cycles:
+            done[cycling] |= m + 1 >= np.minimum(p, remaining)
+            new = ~done & ~cycling & engine.cycled(z, saved[samples])
+            if new.any():
+                detected[samples[new]] = iterations[new]
+                period[samples[new]] = iterations[new] - saved_at[samples[new]]
+                if stats is not None:
+                    remaining = end[new] - 1 - iterations[new]
+                    stats['saved iterations'] += int((remaining - np.minimum(period[samples[new]], remaining)).sum())
+            save = ~cycling & (((iterations + 1) & (iterations + 2)) == 0)  # after 1, 3, 7, 15, ... iterations like engine.Periodicity
+            saved[samples[save]], saved_at[samples[save]] = z[save], iterations[save]
+        return done
+
+    iterate(f, c, visit, batch, progress)
+    flush(buffer[:fill], point_weights[:fill] if weighted else None)
+    return total + fill
+
+
+def trace(f: Callable, c: np.ndarray, left_at: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int], hist: np.ndarray, batch: int = 4096, buffer_size: int = 2 ** 20,
+          progress: Callable = None, weights: np.ndarray = None, channels: np.ndarray = None, until_outside: bool = False, cycles: bool = False, stats: Counter = None) -> int:
+    '''adds the points of every orbit (see follow) to the (h, w) histogram, returns the number of points
+    every point of orbit j counts weights[j] if given, otherwise 1
+    with channels, a bool (orbits, channels) array, hist is (channels, h, w) and orbit j is added to every channel where channels[j]'''
+    flat = hist.reshape(-1)
+
+    def flush(index: np.ndarray, weight: np.ndarray) -> None:
+        np.add.at(flat, index, 1 if weight is None else weight)
+
+    return follow(f, c, left_at, real, imag, shape, flush, batch, buffer_size, progress, weights, channels, until_outside, cycles, stats)
+
+
+def hits(f: Callable, c: np.ndarray, left_at: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int], batch: int = 4096, buffer_size: int = 2 ** 20,
+         until_outside: bool = False, cycles: bool = False, stats: Counter = None) -> tuple[np.ndarray, np.ndarray]:
+    # (sorted unique flat pixel indices, counts) of the points of every orbit (see follow), sparse instead of a whole histogram
+    indices, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    def flush(index: np.ndarray, weight: np.ndarray) -> None:
+        nonlocal indices, counts
+        indices, inverse = np.unique(np.concatenate((indices, index)), return_inverse=True)
+        weight = np.ones(index.size) if weight is None else weight
+        counts = np.rint(np.bincount(inverse, weights=np.concatenate((counts, weight)), minlength=indices.size)).astype(np.int64)
+
+    follow(f, c, left_at, real, imag, shape, flush, batch, buffer_size, until_outside=until_outside, cycles=cycles, stats=stats)
+    return indices, counts
@@ -0,0 +1,99 @@
+import numpy as np
+from typing import Iterable, Iterator
+
+import stream
+import tonemap
+import writer
+
+LUT_SIZE = 2 ** 16
+
+
+class Gradient:  # multi-stop color gradient, colors as RGB in [0, 1], mapped through a lookup table to BGR like cv2
+    cyclic = False
+
+    def __init__(self, stops: list[tuple[float, tuple[float, float, float]]], size: int = LUT_SIZE):
+        '''stops are (position, color) with positions in [0, 1], or only colors at equal distances'''
+        stops = [stop if len(stop) == 2 and np.ndim(stop[1]) == 1 else (n / max(1, len(stops) - 1), stop) for n, stop in enumerate(stops)]
+        positions, colors = zip(*sorted(stops, key=lambda stop: stop[0]))
+        self.stops = stops
+        x = np.linspace(0, 1, size)
+        self.table = np.stack([np.interp(x, positions, [color[channel] for color in colors]) for channel in (2, 1, 0)], axis=1)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.stops})'
+
+    def lookup(self, x: np.ndarray) -> np.ndarray:  # x in [0, 1] -> (*x.shape, 3)
+        index = (np.clip(x, 0, 1) * (len(self.table) - 1) + 0.5).astype(np.intp)
+        return np.take(self.table, index, axis=0)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:  # normalized strip -> BGR strip
+        return self.lookup(x)
+
+
+class Cycle(Gradient):  # cyclic palette indexed by the smooth iteration count itself, repeats every period iterations
+    cyclic = True
+
+    def __init__(self, stops: list, period: float = 32., offset: float = 0., inside: tuple[float, float, float] = (0., 0., 0.), size: int = LUT_SIZE):
+        super().__init__(stops, size)
+        if period <= 0:
+            raise ValueError(f"'period' must be positive not {period}")
+        self.period = period
+        self.offset = offset
+        self.inside = np.array(inside[::-1], dtype=float)
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:  # raw strip -> BGR strip, 0 (not escaped) is inside
+        bgr = self.lookup(np.mod(values / self.period + self.offset, 1))
+        bgr[values == 0] = self.inside
+        return bgr
+
+
+GRAY = Gradient([(0., 0., 0.), (1., 1., 1.)])
+FIRE = Gradient([(0., 0., 0.), (.5, 0., 0.), (1., .5, 0.), (1., 1., .3), (1., 1., 1.)])
+OCEAN = Gradient([(0., 0., 0.), (0., .1, .3), (0., .5, .8), (.6, .9, 1.), (1., 1., 1.)])
+ULTRA = Cycle([(0., .03, .39), (.13, .42, .8), (.93, 1., 1.), (1., .67, 0.), (0., .01, 0.), (0., .03, .39)])
+NEBULA = ((1., 0., 0.), (0., 1., 0.), (0., 0., 1.))  # red, green and blue channel, Melinda Green's coloring
+
+
+def spectrum(count: int) -> list[tuple[float, float, float]]:  # count hues evenly around the color wheel from red, NEBULA for 3
+    hue = 6 * np.arange(count) / count
+    return [(float(np.clip(abs(h - 3) - 1, 0, 1)), float(np.clip(2 - abs(h - 2), 0, 1)), float(np.clip(2 - abs(h - 4), 0, 1))) for h in hue]
+
+
+def composite(strips: Iterable[np.ndarray], colors: Iterable[tuple[float, float, float]]) -> np.ndarray:  # Σ strip · color, clipped to [0, 1]
+    bgr = None
+    for strip, color in zip(strips, colors):
+        layer = strip[..., None] * np.array(color[::-1], dtype=float)
+        bgr = layer if bgr is None else bgr + layer
+    return np.clip(bgr, 0, 1, out=bgr)
+
+
+def nebula(images: list, colors: Iterable[tuple[float, float, float]] = NEBULA, percentile: float = 3., tone: str = 'asinh') -> Iterator[np.ndarray]:
+    '''BGR strips of rendered images (e.g. Nebulabrot with different max_iterations) composited with one color each'''
+    strips = [image.strips(image.arr, image.normalization(image.arr, percentile, tone)) for image in images]
+    colors = list(colors)
+    for layers in zip(*strips):
+        yield composite(layers, colors)
+
+
+def channels(arr: np.ndarray, colors: Iterable[tuple[float, float, float]] = None, percentile: float = 3., tone: str = 'asinh') -> Iterator[np.ndarray]:
+    '''BGR strips of a stacked (channels, h, w) histogram (e.g. Buddhabrot with windows), every channel tone mapped on its own and composited with its color'''
+    colors = spectrum(len(arr)) if colors is None else list(colors)
+    normalizations = [tonemap.normalization(a, percentile, tone) if a.any() else np.zeros_like for a in arr]  # channels without orbits stay black
+    for a, b in stream.row_strips(*arr.shape[1:]):
+        yield composite((normalize(layer[a:b]) for normalize, layer in zip(normalizations, arr)), colors)
+
+
+def save(filename: str, shape: tuple[int, int], strips: Iterable[np.ndarray], depth: int = 16) -> None:  # BGR strips in [0, 1]
+    dtype = np.uint8 if depth == 8 else np.uint16 if depth == 16 else None
+    if dtype is None:
+        raise ValueError(f"'depth' must be 8 or 16 not {depth}")
+    with writer.writer(filename, shape, dtype, channels=3) as image:
+        for strip in strips:
+            image.write((strip * (2 ** depth - 1)).astype(dtype))
+
+
+def colorize(arr: np.ndarray, palette: Gradient) -> np.ndarray:  # whole normalized (or raw, if cyclic) array to BGR, strip by strip
+    bgr = np.empty((*arr.shape, 3))
+    for a, b in stream.row_strips(*arr.shape):
+        bgr[a:b] = palette(arr[a:b])
+    return bgr
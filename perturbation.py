@@ -0,0 +1,133 @@
+from decimal import Decimal, localcontext
+from math import ceil, comb, log10
+import numpy as np
+from typing import Callable
+
+
+class Reference:
+    def __init__(self, real: tuple, imag: tuple, shape: tuple[int, int], degree: int, max_iterations: int, max_magnitude: float, terms: int = 4, tolerance: float = 2 ** -40,
+                 orbit: np.ndarray = None):  # orbit of a reference with the same center and at least this precision, e.g. of a deeper view
+        w, h = shape
+        (re1, re2), (im1, im2) = real, imag
+        diff_re, diff_im = Decimal(re2) - Decimal(re1), Decimal(im2) - Decimal(im1)
+
+        self.degree = degree
+        self.precision = max(30, ceil(-log10(float(min(abs(diff_re) / w, abs(diff_im) / h)))) + 20)
+        with localcontext() as context:
+            context.prec = self.precision
+            self.center = ((Decimal(re1) + Decimal(re2)) / 2, (Decimal(im1) + Decimal(im2)) / 2)
+
+        # pixel (x, y) -> δc = (x - w/2) · Δre + i · (y - h/2) · Δim, see functions.xy2complex
+        self.shape = shape
+        self.scale = (float(diff_re / w), float(diff_im / h))
+        self.radius = abs(complex(*self.scale)) * (max(w, h) / 2 + 1)
+
+        self.orbit = self.reference_orbit(max_iterations, max_magnitude) if orbit is None else orbit
+        self.skip, self.series = self.series_approximation(max_magnitude, terms, tolerance)
+
+    def delta_c(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        w, h = self.shape
+        return (x - w / 2) * self.scale[0] + 1j * (y - h / 2) * self.scale[1]
+
+    def reference_orbit(self, max_iterations: int, max_magnitude: float) -> np.ndarray:  # Z_n in high precision, rounded to complex
+        orbit = np.zeros(max_iterations + 1, dtype=complex)
+        with localcontext() as context:
+            context.prec = self.precision
+            c_re, c_im = self.center
+            re, im = Decimal(0), Decimal(0)
+            bailout = Decimal(max_magnitude) ** 2
+            for n in range(1, max_iterations + 1):
+                re, im = _power(re, im, self.degree)
+                re, im = re + c_re, im + c_im
+                orbit[n] = complex(float(re), float(im))
+                if re * re + im * im > bailout:  # reference escaped, pixels past this point get rebased
+                    return orbit[:n + 1]
+        return orbit
+
+    def series_approximation(self, max_magnitude: float, terms: int, tolerance: float) -> tuple[int, list[complex]]:
+        # δ_n = Σ b_k · u ** (k + 1) with u = δc / radius, |u| <= 1
+        b = [0j] * terms
+        for n in range(len(self.orbit) - 1):
+            z = self.orbit[n]
+            new, power = [0j] * terms, b
+            new[0] = self.radius
+            for j in range(1, self.degree + 1):  # Σ C(d, j) · Z_n ** (d - j) · δ_n ** j
+                coefficient = comb(self.degree, j) * z ** (self.degree - j)
+                for k in range(terms):
+                    new[k] += coefficient * power[k]
+                power = _series_product(power, b)
+            if abs(new[-1]) > tolerance * abs(new[0]) or abs(self.orbit[n + 1]) + sum(abs(a) for a in new) > max_magnitude:
+                return n, b
+            b = new
+        return len(self.orbit) - 1, b
+
+    def step(self, z: np.ndarray, delta: np.ndarray, dc: np.ndarray) -> np.ndarray:  # δ_(n+1) = (Z_n + δ_n) ** d - Z_n ** d + δc
+        if self.degree == 2:
+            return (2 * z + delta) * delta + dc
+        result, z_power = np.ones_like(delta), z
+        for j in range(self.degree - 1, 0, -1):
+            result = result * delta + comb(self.degree, j) * z_power
+            z_power = z_power * z
+        return result * delta + dc
+
+    def escape_time(self, f: Callable, dc: np.ndarray, max_iterations: int, extra_iterations: int, max_magnitude: float) -> tuple[np.ndarray, np.ndarray, dict]:
+        # same result as Mandelbrot.calculate_pixel(center + δc), rebasing δ onto Z_0 whenever |Z_m + δ| < |δ| (glitch)
+        shape = dc.shape
+        dc = dc.ravel()
+        skip = min(self.skip, max_iterations)
+
+        u, delta = dc / self.radius, np.zeros_like(dc)
+        for b in self.series[::-1]:
+            delta = (delta + b) * u
+        m = np.full(dc.size, skip)
+
+        z_out, i_out = np.zeros(dc.size, dtype=complex), np.zeros(dc.size, dtype=int)
+        active, last, rebases = np.arange(dc.size), len(self.orbit) - 1, 0
+        stats = {'skipped iterations': skip * dc.size}
+        c_center = complex(float(self.center[0]), float(self.center[1]))
+        with np.errstate(over='ignore', invalid='ignore'):
+            for n in range(skip, max_iterations):
+                delta = self.step(self.orbit[m], delta, dc)
+                m += 1
+                z = self.orbit[m] + delta
+                abs_z = np.abs(z)
+
+                escaped = abs_z > max_magnitude
+                if escaped.any():
+                    z_escaped, c_escaped = z[escaped], c_center + dc[escaped]
+                    for _ in range(extra_iterations):
+                        z_escaped = f(z=z_escaped, c=c_escaped)
+                    z_out[active[escaped]] = z_escaped
+                    i_out[active[escaped]] = n
+
+                    inside = ~escaped
+                    delta, dc, m, active, z, abs_z = delta[inside], dc[inside], m[inside], active[inside], z[inside], abs_z[inside]
+                    if active.size == 0:
+                        break
+
+                rebase = (abs_z < np.abs(delta)) | (m == last)
+                if rebase.any():
+                    delta[rebase], m[rebase] = z[rebase], 0
+                    rebases += np.count_nonzero(rebase)
+            z_out[active] = self.orbit[m] + delta
+        stats['rebased'] = rebases
+        return z_out.reshape(shape), i_out.reshape(shape), stats
+
+
+def _power(re: Decimal, im: Decimal, n: int) -> tuple[Decimal, Decimal]:  # (re + i·im) ** n
+    result_re, result_im = Decimal(1), Decimal(0)
+    while n:
+        if n & 1:
+            result_re, result_im = result_re * re - result_im * im, result_re * im + result_im * re
+        n >>= 1
+        if n:
+            re, im = re * re - im * im, 2 * re * im
+    return result_re, result_im
+
+
+def _series_product(p: list[complex], q: list[complex]) -> list[complex]:  # both without constant term, truncated
+    result = [0j] * len(p)
+    for i, a in enumerate(p):
+        for j, b in enumerate(q[:len(p) - i - 1]):
+            result[i + j + 1] += a * b
+    return result
@@ -0,0 +1,95 @@
+import numpy as np
+
+import functions
+
+STARTS = 16  # candidate start angles of the sector, evenly around the circle
+BANDS = (1, 2, 4, 8)  # candidate numbers of row bands that cover the sector, more only if they save 10% of the pixels
+ALIGN = 32  # sides of the boxes are multiples of this, so that Julia.get_squares does not split them into tiny squares
+
+
+def fold(z: np.ndarray, order: int, start: float = 0.) -> np.ndarray:  # z rotated by a multiple of 2π / order into the sector start <= arg(z) < start + 2π / order
+    k = (np.mod(np.angle(z) - start, 2 * np.pi) * (order / (2 * np.pi))).astype(np.intp) % order  # mod may round up to 2π
+    return z * np.exp(-2j * np.pi * np.arange(order) / order)[k]
+
+
+def clip(polygon: list[complex], normal: complex, point: complex = 0j) -> list[complex]:  # part of a convex polygon with Re((z - point) · conj(normal)) >= 0, Sutherland-Hodgman
+    result = []
+    for a, b in zip(polygon, polygon[1:] + polygon[:1]):
+        da, db = ((a - point) * normal.conjugate()).real, ((b - point) * normal.conjugate()).real
+        if da >= 0:
+            result.append(a)
+        if (da >= 0) != (db >= 0):
+            result.append(a + (b - a) * da / (da - db))
+    return result
+
+
+def pieces(real: tuple, imag: tuple, order: int, start: float) -> list[list[complex]]:
+    '''the view folded into the sector from start (see fold) as convex polygons, one per rotation of the view clipped to the sector, which is convex for order >= 2'''
+    corners = [complex(real[0], imag[0]), complex(real[1], imag[0]), complex(real[1], imag[1]), complex(real[0], imag[1])]
+    first, last = np.exp(1j * start), np.exp(1j * (start + 2 * np.pi / order))
+    polygons = [clip(clip([complex(z * np.exp(-2j * np.pi * k / order)) for z in corners], 1j * first), -1j * last) for k in range(order)]
+    return [polygon for polygon in polygons if polygon]
+
+
+def boxes(polygons: list[list[complex]], real: tuple, imag: tuple, shape: tuple[int, int], bands: int) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    '''((x, y) of the first pixel, (w, h)) of up to bands boxes of consecutive rows that hold the nearest pixels of all points of the polygons
+    pixels are the points of functions.grid2complex, x and y may be outside the view'''
+    w, h = shape
+    points = np.array([z for polygon in polygons for z in polygon])
+    y0, y1 = int(np.floor(functions.linmap(points.imag.min(), imag, (0, h)))), int(np.ceil(functions.linmap(points.imag.max(), imag, (0, h))))
+    band_h = -(-(y1 + 1 - y0) // (bands * ALIGN)) * ALIGN
+    result = []
+    for a in range(y0, y1 + 1, band_h):  # points rounded to rows a to a + band_h - 1
+        low, high = complex(0, functions.linmap(a - 0.5, (0, h), imag)), complex(0, functions.linmap(a + band_h - 0.5, (0, h), imag))
+        band = [z for polygon in polygons for z in clip(clip(polygon, 1j, low), -1j, high)]
+        if band:
+            x = functions.linmap(np.array(band).real, real, (0, w))
+            x0, x1 = int(np.floor(x.min())), int(np.ceil(x.max()))
+            result.append(((x0, a), (-(-(x1 + 1 - x0) // ALIGN) * ALIGN, band_h)))
+    return result
+
+
+def sector(real: tuple, imag: tuple, shape: tuple[int, int], order: int) -> tuple[float, list[tuple[tuple[int, int], tuple[int, int]]]]:
+    '''start of the sector and boxes of view pixels (see boxes) with the fewest pixels that hold every pixel of the view folded into it'''
+    best, best_pixels = None, np.inf
+    for start in 2 * np.pi * np.arange(STARTS) / STARTS:
+        polygons = pieces(real, imag, order, start)
+        chosen, pixels = None, np.inf
+        for bands in BANDS:
+            candidate = boxes(polygons, real, imag, shape, bands)
+            size = sum(w * h for _, (w, h) in candidate)
+            if size < 0.9 * pixels:
+                chosen, pixels = candidate, size
+        if pixels < best_pixels:
+            best, best_pixels = (float(start), chosen), pixels
+    return best
+
+
+def exact(real: tuple, imag: tuple, shape: tuple[int, int], order: int) -> bool:
+    '''rotation by 2π / order maps every pixel of the view (see functions.grid2complex) onto a pixel, e.g. by 180° and 90° (square pixels) in views centered at 0
+    the origin and both steps of the grid must rotate onto whole pixel steps, which excludes orders 3 and above 4'''
+    w, h = shape
+    step_x, step_y = (real[1] - real[0]) / w, (imag[1] - imag[0]) / h
+    turn, origin = np.exp(2j * np.pi / order), complex(real[0], imag[0])
+    moves = np.array([turn * origin - origin, turn * step_x, turn * 1j * step_y])
+    steps = np.concatenate((moves.real / step_x, moves.imag / step_y))
+    return bool(np.allclose(steps, np.rint(steps), rtol=0, atol=1e-6))
+
+
+def unfold(arrays: list[np.ndarray], boxes: list[tuple[tuple[int, int], tuple[int, int]]], z: np.ndarray, real: tuple, imag: tuple, shape: tuple[int, int],
+           order: int, start: float) -> np.ndarray:
+    '''values at the view points z from the arrays of the boxes of the sector (see sector), nearest pixel of the folded points, reads only those pixels of memory-mapped arrays
+    exact for rotations that map pixels onto pixels (see exact), otherwise a value is sampled up to half a pixel in x and y away from its point,
+    which changes pixels at steep edges of the image by up to their difference to a neighbour'''
+    w, h = shape
+    folded = fold(z, order, start)
+    x = np.rint(functions.linmap(folded.real, real, (0, w))).astype(np.intp)
+    y = np.rint(functions.linmap(folded.imag, imag, (0, h))).astype(np.intp)
+    box = np.searchsorted([y0 for (_, y0), _ in boxes], y, side='right') - 1  # boxes are bands of rows from top to bottom
+    box = np.maximum(box, 0, out=box)
+    values = np.zeros(z.shape)
+    for k, (array, ((x0, y0), (box_w, box_h))) in enumerate(zip(arrays, boxes)):
+        here = box == k
+        y_box, x_box = y[here] - y0, x[here] - x0
+        values[here] = array[np.minimum(np.maximum(y_box, 0, out=y_box), box_h - 1, out=y_box), np.minimum(np.maximum(x_box, 0, out=x_box), box_w - 1, out=x_box)]  # np.clip is much slower for integers
+    return values
@@ -0,0 +1,116 @@
+from collections import Counter
+from multiprocessing import shared_memory
+import numpy as np
+import os
+import pickle
+import time
+
+import functions
+
+_locks, _canvas, _objects = [], None, {}  # canvas strip locks, attached canvas and published objects of this worker process
+
+
+def initializer(locks: list = ()) -> None:
+    global _locks
+    _locks = list(locks)
+
+
+def attach(spec: tuple[type, str, tuple[int, ...]]) -> np.ndarray:  # SharedCanvas.spec
+    global _canvas
+    if _canvas is None or _canvas.spec != spec:
+        if _canvas is not None:
+            _canvas.close()
+        kind, name, shape = spec
+        _canvas = kind(shape, name=name)
+    return _canvas.arr
+
+
+def lookup(key: tuple[str, int]):  # object published by RenderContext.publish
+    if key not in _objects:
+        _objects.clear()
+        shm = shared_memory.SharedMemory(name=key[0])
+        _objects[key] = pickle.loads(bytes(shm.buf[:key[1]]))
+        shm.close()
+    return _objects[key]
+
+
+def work(job: tuple) -> tuple:
+    key, delta, area, corner, size, spec = job
+    start = time.perf_counter()
+    obj = lookup(key)
+    obj.delta = delta
+    obj.stats = Counter()
+    result = obj.write_tile(attach(spec), area, corner, size, obj.render_tile(area, corner, size), _locks)
+    return (area, corner, size), result, obj.stats, os.getpid(), time.perf_counter() - start
+
+
+def work_pixels(job: tuple) -> tuple:
+    key, delta, area, chunk, x, y = job
+    start = time.perf_counter()
+    obj = lookup(key)
+    obj.delta = delta
+    obj.stats = Counter()
+    values = obj.render_pixels(area, x, y)
+    return area, chunk, values, obj.stats, os.getpid(), time.perf_counter() - start
+
+
+def call(job: tuple):
+    key, method, arg = job
+    return getattr(lookup(key), method)(arg)
+
+
+def cost_map(obj, area: tuple, step: int) -> np.ndarray:  # estimated iterations per pixel, one sample per step × step cell
+    real, imag, _, (w, h) = area
+    y, x = np.meshgrid(np.arange(step / 2, h, step), np.arange(step / 2, w, step), indexing='ij')
+    if getattr(obj, 'deep_zoom', False):  # bounds may be Decimal, samples relative to the reference orbit
+        reference = obj.references[obj.render_areas.index(area)]
+        z, i, _ = reference.escape_time(obj.kernel, reference.delta_c(x, y), obj.max_iterations, obj.extra_iterations, obj.max_magnitude)
+        return np.where((i == 0) & (np.abs(z) <= obj.max_magnitude), obj.max_iterations, i + 1)
+    c = functions.grid2complex(x, y, real, imag, (w, h))
+    stats, obj.stats = obj.stats, Counter()  # the samples are not part of the render
+    try:
+        z, i = obj.calculate_pixels(c)
+    finally:
+        obj.stats = stats
+    cost = np.where((i == 0) & (np.abs(z) <= obj.max_magnitude), obj.max_iterations, i + 1)
+    interior = obj.interior(c) if hasattr(obj, 'interior') else None  # pre-rejected without iterating
+    return cost if interior is None else np.where(interior, 1, cost)
+
+
+def square_cost(costs: np.ndarray, step: int, corner: tuple[int, int], size: int) -> float:
+    (x0, y0), (rows, cols) = corner, costs.shape
+    cells = costs[min(y0 // step, rows - 1):(y0 + size - 1) // step + 1, min(x0 // step, cols - 1):(x0 + size - 1) // step + 1]  # last pixels may lie past the last sample
+    return float(cells.mean()) * size ** 2
+
+
+def plan(obj, threads: int, samples: int = 4096, min_size: int = 8) -> list[tuple[float, int, tuple[int, int], int]]:
+    '''(cost, area, corner, size) of every square, most expensive first
+    squares that would still be running when the other workers run out of work are split into quarters'''
+    jobs, maps = [], []
+    for j, (area, squares) in enumerate(zip(obj.render_areas, obj.squares)):
+        w, h = area[3]
+        step = max(1, round(np.sqrt(w * h / samples)))
+        maps.append((cost_map(obj, area, step), step))
+        jobs += [(square_cost(*maps[j], corner, size), j, corner, size) for corner, size in squares]
+
+    while True:
+        jobs.sort(key=lambda job: job[0], reverse=True)
+        remaining = np.cumsum([job[0] for job in jobs][::-1])[::-1]  # work left when the job is handed out
+        split = [threads * job[0] > left and job[3] >= 2 * min_size for job, left in zip(jobs, remaining)]
+        if not any(split):
+            return jobs
+
+        new_jobs = []
+        for (cost, j, (x0, y0), size), s in zip(jobs, split):
+            if s:
+                half = size // 2
+                for corner in ((x0, y0), (x0 + half, y0), (x0, y0 + half), (x0 + half, y0 + half)):
+                    new_jobs.append((square_cost(*maps[j], corner, half), j, corner, half))
+            else:
+                new_jobs.append((cost, j, (x0, y0), size))
+        jobs = new_jobs
+
+
+def utilization(busy: Counter, threads: int, elapsed: float) -> list[float]:  # busy fraction of each worker, idle workers included
+    fractions = sorted((t / elapsed for t in busy.values()), reverse=True)
+    return fractions + [0.0] * (threads - len(fractions))
@@ -0,0 +1,63 @@
+import numpy as np
+from typing import Callable, Iterator
+
+
+def row_strips(h: int, w: int, size: int = 2 ** 22) -> Iterator[tuple[int, int]]:  # (first, last) rows of strips with about size pixels
+    rows = max(1, size // max(1, w))
+    for y in range(0, h, rows):
+        yield y, min(h, y + rows)
+
+
+def minmax(arr: np.ndarray) -> tuple[float, float]:
+    lo, hi = np.inf, -np.inf
+    for a, b in row_strips(*arr.shape[:2]):
+        strip = arr[a:b]
+        lo, hi = min(lo, strip.min()), max(hi, strip.max())
+    return float(lo), float(hi)
+
+
+def order_statistic(values: Callable[[], Iterator[np.ndarray]], k: int, lo: float, hi: float, bins: int = 4096, limit: int = 2 ** 20) -> float:
+    '''k-th smallest (from 0) of all values in [lo, hi], values() yields them in 1d arrays and is called once per pass
+    the range shrinks to the bin holding the k-th value until that bin is small enough to sort'''
+    while lo < hi:
+        counts, lows, highs = np.zeros(bins, dtype=np.int64), np.full(bins, np.inf), np.full(bins, -np.inf)
+        scale = bins / (hi - lo)
+        for v in values():
+            v = v[(v >= lo) & (v <= hi)]
+            index = np.minimum(((v - lo) * scale).astype(np.int64), bins - 1)  # monotone in v, so every bin is an interval
+            counts += np.bincount(index, minlength=bins)
+            np.minimum.at(lows, index, v)
+            np.maximum.at(highs, index, v)
+        cumulative = np.cumsum(counts)
+        b = int(np.searchsorted(cumulative, k, side='right'))
+        k -= int(cumulative[b - 1]) if b else 0
+        if counts[b] <= limit or (lows[b], highs[b]) == (lo, hi):  # small enough or cannot be split further
+            selected = np.concatenate([v[(v >= lows[b]) & (v <= highs[b])] for v in values()])
+            return float(np.partition(selected, k)[k])
+        lo, hi = lows[b], highs[b]
+    return float(lo)
+
+
+def percentile(values: Callable[[], Iterator[np.ndarray]], q: float) -> float:  # np.percentile(all values, q)
+    n, lo, hi = 0, np.inf, -np.inf
+    for v in values():
+        if v.size:
+            n, lo, hi = n + v.size, min(lo, v.min()), max(hi, v.max())
+    if n == 0:
+        raise ValueError('no values')
+
+    index = (n - 1) * (q / 100)
+    k = int(np.floor(index))
+    t = index - k
+    a = order_statistic(values, k, lo, hi)
+    if t == 0:
+        return a
+    b = order_statistic(values, k + 1, lo, hi)
+    return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+
+def histogram(values: Callable[[], Iterator[np.ndarray]], bins: int, lo: float, hi: float) -> tuple[np.ndarray, np.ndarray]:  # np.histogram(all values, bins, (lo, hi))
+    counts = np.zeros(bins, dtype=np.int64)
+    for v in values():
+        counts += np.histogram(v, bins, (lo, hi))[0]
+    return counts, np.linspace(lo, hi, bins + 1)
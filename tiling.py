@@ -0,0 +1,56 @@
+import numpy as np
+from typing import Callable
+
+CHILDREN = np.array([[0, 0], [1, 0], [0, 1], [1, 1]])
+
+
+def border(size: int) -> tuple[np.ndarray, np.ndarray]:  # (x, y) offsets of the outline of a size × size square
+    if size == 1:
+        return np.zeros(1, dtype=int), np.zeros(1, dtype=int)
+    i, zeros, ones = np.arange(size - 1), np.zeros(size - 1, dtype=int), np.full(size - 1, size - 1)
+    return np.concatenate((i, ones, i + 1, zeros)), np.concatenate((zeros, i, ones, i + 1))
+
+
+def mariani_silver(evaluate: Callable, x0: int, y0: int, size: int, fillable: Callable, check: bool = False) -> tuple[np.ndarray, list, int]:
+    '''evaluate(x, y) -> (values, counts) for arrays of pixel coordinates
+    squares whose border has one count c with fillable(c) are filled from their border values'''
+    values = np.zeros((size, size))
+    counts = np.zeros((size, size), dtype=int)
+    computed = np.zeros((size, size), dtype=bool)
+
+    origins, checked, evaluated = np.zeros((1, 2), dtype=int), [], 0
+    while len(origins):  # all squares of one level have the same size
+        dx, dy = border(size)
+        x, y = origins[:, :1] + dx, origins[:, 1:] + dy
+        todo = ~computed[y, x]
+        if todo.any():
+            x_todo, y_todo = x[todo], y[todo]
+            values[y_todo, x_todo], counts[y_todo, x_todo] = evaluate(x_todo + x0, y_todo + y0)
+            computed[y_todo, x_todo] = True
+            evaluated += x_todo.size
+        if size <= 2:  # border is the whole square
+            break
+
+        border_counts = counts[y, x]
+        uniform = (border_counts == border_counts[:, :1]).all(axis=1) & fillable(border_counts[:, 0])
+        if uniform.any():
+            fill(values, origins[uniform], size)
+
+        split = origins[~uniform]
+        if check:
+            checked += [((int(x) + x0, int(y) + y0), size) for x, y in split]
+        size //= 2
+        origins = (split[:, None, :] + size * CHILDREN).reshape(-1, 2)
+    return values, checked, evaluated
+
+
+def fill(values: np.ndarray, origins: np.ndarray, size: int) -> None:  # Coons patch of the border values, exact for constant borders
+    r, end = np.arange(1, size - 1), size - 1
+    x, y = origins[:, :1], origins[:, 1:]
+    top, bottom = values[y, x + r][:, None, :], values[y + end, x + r][:, None, :]
+    left, right = values[y + r, x][:, :, None], values[y + r, x + end][:, :, None]
+    p00, p10, p01, p11 = (values[y + j, x + i][:, :, None] for i, j in ((0, 0), (end, 0), (0, end), (end, end)))
+
+    u, v = (r / end)[None, None, :], (r / end)[None, :, None]
+    corners = (1 - u) * (1 - v) * p00 + u * (1 - v) * p10 + (1 - u) * v * p01 + u * v * p11
+    values[y[:, :, None] + r[None, :, None], x[:, :, None] + r[None, None, :]] = (1 - v) * top + v * bottom + (1 - u) * left + u * right - corners
@@ -0,0 +1,91 @@
+import numpy as np
+from typing import Callable
+
+import functions
+import stream
+
+LUT_SIZE = 2 ** 16
+METHODS = ('asinh', 'equalize', 'gamma', 'linear', 'log')
+
+
+def lut(f: Callable, size: int = LUT_SIZE) -> np.ndarray:  # f sampled on [0, 1]
+    return f(np.linspace(0, 1, size))
+
+
+def apply_lut(x: np.ndarray, table: np.ndarray) -> np.ndarray:  # table linearly interpolated at x in [0, 1]
+    position = np.clip(x, 0, 1) * (len(table) - 1)
+    i = np.minimum(position.astype(np.int64), len(table) - 2)
+    return table[i] + (position - i) * (table[i + 1] - table[i])
+
+
+def log_stretch(median: float) -> Callable:  # log(1 + a·x) / log(1 + a) with median -> 0.5
+    if median >= 0.5:
+        return lambda x: x
+    lo, hi = 0., 1.
+    while np.log1p(hi * median) / np.log1p(hi) < 0.5:
+        hi *= 2
+    for _ in range(100):  # log1p(a·m) / log1p(a) increases with a
+        a = (lo + hi) / 2
+        lo, hi = (a, hi) if np.log1p(a * median) / np.log1p(a) < 0.5 else (lo, a)
+    return lambda x: np.log1p(a * x) / np.log1p(a)
+
+
+def gamma_stretch(median: float) -> Callable:  # x ** g with median -> 0.5
+    g = np.log(0.5) / np.log(median) if 0 < median < 1 else 1
+    return lambda x: x ** g
+
+
+def statistics(arr: np.ndarray, percentile: float = 3., bounds: tuple[float, float] = None) -> tuple[float, float, float or None]:
+    '''(min, max, median) of arr in streaming passes over row strips, median is the (100 - percentile)th percentile of nonzero (arr - min) / (max - min), None for percentile 0
+    bounds are (min, max) of arr if already known'''
+    lo, hi = stream.minmax(arr) if bounds is None else bounds
+    if hi == 0.0:
+        raise ValueError('cannot normalize an array of zeros')
+    if percentile == 0.0:
+        return lo, hi, None
+
+    span = hi - lo
+    def values():
+        for a, b in stream.row_strips(*arr.shape):
+            strip = (arr[a:b] - lo) / span
+            yield strip[strip != 0]
+    return lo, hi, stream.percentile(values, 100 - percentile)
+
+
+def mapping(lo: float, hi: float, median: float or None, method: str = 'asinh') -> Callable[[np.ndarray], np.ndarray]:  # tone map of a strip to [0, 1] from statistics
+    if method not in METHODS or method == 'equalize':
+        raise ValueError(f"'method' must be one of {tuple(m for m in METHODS if m != 'equalize')} not {method!r}, equalize needs the whole histogram")
+    if method == 'linear' or median is None:
+        return lambda strip: strip / hi
+    span = hi - lo
+    if method == 'asinh':
+        return lambda strip: functions.stretch((strip - lo) / span, median)
+    table = lut(log_stretch(median) if method == 'log' else gamma_stretch(median))
+    return lambda strip: apply_lut((strip - lo) / span, table)
+
+
+def normalization(arr: np.ndarray, percentile: float = 3., method: str = 'asinh', bounds: tuple[float, float] = None, bins: int = LUT_SIZE) -> Callable[[np.ndarray], np.ndarray]:
+    '''statistics of arr in streaming passes over row strips, returns the tone map of a strip to [0, 1]
+    percentile 0 divides by the maximum, otherwise the (100 - percentile)th percentile of nonzero values is stretched to 0.5
+    equalize maps every nonzero value to its rank among all nonzero values (histogram coloring), 0 stays 0
+    bounds are (min, max) of arr if already known'''
+    if method not in METHODS:
+        raise ValueError(f"'method' must be one of {METHODS} not {method!r}")
+    lo, hi = stream.minmax(arr) if bounds is None else bounds
+    if hi == 0.0:
+        raise ValueError('cannot normalize an array of zeros')
+
+    if method == 'equalize':
+        def nonzero():
+            for a, b in stream.row_strips(*arr.shape):
+                strip = arr[a:b]
+                yield strip[strip != 0]
+        counts, edges = stream.histogram(nonzero, bins, lo, hi)
+        cdf = np.concatenate(([0.], np.cumsum(counts) / counts.sum()))
+        return lambda strip: np.where(strip != 0, np.interp(strip, edges, cdf), 0.)
+    return mapping(*statistics(arr, 0. if method == 'linear' else percentile, (lo, hi)), method)
+
+
+def tonemap(arr: np.ndarray, percentile: float = 3., method: str = 'asinh') -> np.ndarray:
+    normalize = normalization(arr, percentile, method)
+    return np.concatenate([normalize(arr[a:b]) for a, b in stream.row_strips(*arr.shape)])
@@ -1,17 +1,78 @@
 import cv2
-from main import Julia
-import math
-import matplotlib.pyplot as plt
+from collections import deque
+from context import RenderContext
+from copy import copy
+from decimal import Decimal, localcontext
+from main import Julia, Mandelbrot
+from math import ceil, floor, log2, log10
 import numpy as np
+import os
+from queue import Queue
+from threading import Thread
 import time
 from typing import Callable
-import os
+
+import perturbation
+import tonemap
+
+NORMALIZATIONS = ('frame', 'global', 'sliding')
+ZOOM_NORMALIZATIONS = ('frame', 'keyframe')
+
+
+def smoothed(statistics: list, window: int = None) -> list[tuple[float, float, float or None] or None]:
+    '''tonemap.statistics of every frame averaged over the window of frames centered at it, over all frames if window is None
+    medians are averaged as values of the arrays, so that the brightness of a value changes smoothly, black frames (None) are left out'''
+    valid = [s for s in statistics if s is not None]
+    if not valid:
+        return [None] * len(statistics)
+    relative = valid[0][2] is not None
+    values = np.array([(np.nan,) * 3 if s is None else (s[0], s[1], s[0] + s[2] * (s[1] - s[0]) if relative else s[1]) for s in statistics])
+    known = ~np.isnan(values[:, 0])
+    n = len(statistics)
+    half = n if window is None else window // 2
+    first, last = np.maximum(np.arange(n) - half, 0), np.minimum(np.arange(n) + half + 1, n)  # frames first to last - 1 are averaged
+    sums = np.concatenate((np.zeros((1, 3)), np.cumsum(np.where(known[:, None], values, 0.), axis=0)))
+    counts = np.concatenate(([0], np.cumsum(known)))
+    sums, counts = sums[last] - sums[first], counts[last] - counts[first]
+    result = []
+    for (lo, hi, level), count in zip(sums, counts):
+        if count == 0:  # no frame with data in the window
+            result.append(None)
+        else:
+            lo, hi, level = lo / count, hi / count, level / count
+            result.append((lo, hi, (level - lo) / (hi - lo) if relative else None))
+    return result
+
+
+def blend(a: tuple or None, b: tuple or None, u: float) -> tuple[float, float, float or None] or None:  # tonemap.statistics a and b mixed by u from 0 (a) to 1 (b) like smoothed
+    if a is None or b is None:
+        return a or b
+    (lo_a, hi_a, median_a), (lo_b, hi_b, median_b) = a, b
+    lo, hi = lo_a + u * (lo_b - lo_a), hi_a + u * (hi_b - hi_a)
+    if median_a is None:
+        return lo, hi, None
+    level = (1 - u) * (lo_a + median_a * (hi_a - lo_a)) + u * (lo_b + median_b * (hi_b - lo_b))
+    return lo, hi, (level - lo) / (hi - lo)
+
+
+def resample(arr: np.ndarray, scale: float, shape: tuple[int, int]) -> np.ndarray:
+    '''(w, h) shaped part of arr around its center pixel (W // 2, H // 2) with scale pixels of arr per pixel, centered at pixel (w / 2, h / 2)
+    averaged over areas first when shrinking, so that the linear interpolation does not alias'''
+    (w, h), (H, W) = shape, arr.shape
+    sigma_x = sigma_y = 1.
+    if scale > 1:
+        size = (max(1, round(W / scale)), max(1, round(H / scale)))
+        arr = cv2.resize(arr, size, interpolation=cv2.INTER_AREA)
+        sigma_x, sigma_y = size[0] / W, size[1] / H
+    # pixel x -> X = W // 2 + (x - w / 2) · scale of arr -> sigma · (X + 0.5) - 0.5 of the shrunk arr, cv2 puts pixel centers at integers
+    m = np.array([[sigma_x * scale, 0, sigma_x * (W // 2 - w / 2 * scale + 0.5) - 0.5], [0, sigma_y * scale, sigma_y * (H // 2 - h / 2 * scale + 0.5) - 0.5]])
+    return cv2.warpAffine(arr, m, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
 
 
 class JuliaVideo:
     __slots__ = ('f_c', 'start', 'end', 'frames', 'julia')
 
-    def __init__(self, start: complex, end: complex, *args, frames: int = 300, sin_exponent: int = 3, **kwargs):
+    def __init__(self, start: complex, end: complex, f: Callable, *args, frames: int = 300, sin_exponent: int = 3, **kwargs):
         re1, im1 = start.real, start.imag
         re2, im2 = end.real, end.imag
 
@@ -20,27 +81,238 @@ class JuliaVideo:
                            (im2 - im1) * (np.sin(np.pi / (2 * frames) * t)) ** sin_exponent + im1)
 
         self.end = end
-        self.julia = Julia(*args, **kwargs)
+        self.julia = Julia(f, start, *args, **kwargs)
         self.julia.info = False
         self.f_c = _f
         self.frames = frames
         self.start = start
 
-    def get(self, file: str = None, extension: str = '.mp4', fps: int = 30, size_offset: int = 3, percentile: float = 3):
+    def statistics(self, context: RenderContext, size_offset: int, percentile: float, preview: int) -> list:  # first pass: tonemap.statistics of every frame rendered at width w // preview
+        julia = copy(self.julia)
+        julia.w, julia.oversample, julia.adaptive = max(1, self.julia.w // preview), 1, False
+        return context.map(julia, 'frame_statistics', [(self.f_c(t), size_offset, percentile) for t in range(self.frames + 1)])
+
+    def encode(self, video: cv2.VideoWriter, frames: Queue, normalizations: Callable[[int, np.ndarray], Callable], errors: list) -> None:  # encoder thread, (t, arr) from frames until None
+        while (item := frames.get()) is not None:
+            if errors:  # keep draining so that the renderer never blocks
+                continue
+            try:
+                t, arr = item
+                normalize = normalizations(t, arr)
+                strips = np.concatenate(list(self.julia.strips(arr, normalize)))
+                video.write((255 * np.clip(strips, 0, 1)).astype(np.uint8))
+            except Exception as error:
+                errors.append(error)
+
+    def get(self, file: str = None, extension: str = '.mp4', fps: int = 30, size_offset: int = 3, percentile: float = 3, tone: str = 'asinh',
+            normalization: str = 'global', window: int = 31, preview: int = 4, buffer: int = None):
+        '''frames are rendered by the workers of one pool, every worker renders whole frames, and handed to an encoder thread in order
+        at most buffer frames (default 2 · threads) are rendered ahead of the encoder, finished frames wait for earlier ones in that window
+        normalization is 'frame' (every frame on its own, flickers), 'global' (statistics of all frames) or 'sliding' (window frames centered at each frame)
+        for 'global' and 'sliding', a first pass at width w // preview collects the statistics of every frame without keeping the frames'''
+        if normalization not in NORMALIZATIONS:
+            raise ValueError(f"'normalization' must be one of {NORMALIZATIONS} not {normalization!r}")
+        if normalization != 'frame' and tone == 'equalize':
+            raise ValueError("'equalize' needs the histogram of every frame, use normalization='frame'")
         start = time.perf_counter()
+        julia = self.julia
+        buffer = 2 * julia.threads if buffer is None else max(1, buffer)
+
+        context = julia.context or RenderContext(julia.threads)  # one pool for all frames
+        context.open()
+        print(f'[INFO] get | {julia.threads} threads | size = (w={julia.w}, h={julia.h()}) | iterations = {julia.max_iterations} | {normalization} normalization')
+        if normalization == 'frame':
+            normalizations = lambda t, arr: julia.normalization(arr, percentile, tone) if arr.any() else np.zeros_like
+        else:
+            statistics = smoothed(self.statistics(context, size_offset, percentile, preview), None if normalization == 'global' else window)
+            print(f'[INFO] get | statistics in {round(time.perf_counter() - start, 2)}s')
+            normalizations = lambda t, arr: np.zeros_like if statistics[t] is None else tonemap.mapping(*statistics[t], tone)
+
+        video = cv2.VideoWriter('__temp_video__' + extension, cv2.VideoWriter_fourcc(*'mp4v'), fps, (julia.w, julia.h()), False)
+        frames, errors = Queue(maxsize=max(1, buffer // 2)), []
+        encoder = Thread(target=self.encode, args=(video, frames, normalizations, errors), daemon=True)
+        encoder.start()
+        try:
+            with context.publish(julia) as key:
+                pending = deque()
+                for t in range(self.frames + 1):
+                    pending.append((t, context.apply(key, 'frame', (self.f_c(t), size_offset))))
+                    while pending and (len(pending) >= buffer or t == self.frames):
+                        done, result = pending.popleft()
+                        frames.put((done, result.get()))
+                        print(f'\r[INFO] get | {round(100 * done / max(1, self.frames), 2)}%', end='')
+        finally:
+            frames.put(None)
+            encoder.join()
+            video.release()
+            if julia.context is None:
+                context.close()
+        if errors:
+            raise errors[0]
+
+        if file is None:
+            z_range = f'({complex(julia.real[0], julia.imag[0])}, {complex(julia.real[1], julia.imag[1])})'.replace('(', '').replace(')', '').replace('j', 'i')
+            file = f'JuliaVideo; c({str(self.start).replace("j", "i")}, {str(self.end).replace("j", "i")}); z({z_range}); i({julia.max_iterations}, {julia.extra_iterations}); img({julia.w}, {julia.h()}); r{julia.max_magnitude}; th{julia.threads}; t{round(time.perf_counter() - start, 2)}; o{julia.oversample}; {normalization}'
+        os.rename('__temp_video__' + extension, file + extension)
+        print(f"\r[INFO] get | saved to '{file}{extension}'")
+
+
+class Keyframe(Mandelbrot):  # Mandelbrot that takes the pixels it shares with the previous keyframe of a MandelbrotZoom from it
+    def __init__(self, f: Callable, *args, **kwargs):
+        super().__init__(f, *args, **kwargs)
+        self.known = None  # values of the previous keyframe around its center pixel, see MandelbrotZoom.shared
+
+    def get_render_areas(self) -> None:  # the whole view, the rows of the mirrored half would not line up with the previous keyframe
+        self.sort()
+        self.render_areas, self.sector = [(self.real, self.imag, 0, (self.w, self.h()))], None
+
+    def symmetry(self, arrays: list[np.ndarray], allocate: Callable = np.zeros) -> np.ndarray:
+        return Julia.symmetry(self, arrays, allocate)
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # the previous keyframe has twice the pixel size and the same center pixel (x_c, y_c), so its pixel X is pixel 2 · X - x_c here
+        if self.known is None:
+            return super().evaluate(x, y)
+        x_c, y_c = self.w // 2, self.h() // 2
+        shared = ((x + x_c) % 2 == 0) & ((y + y_c) % 2 == 0)
+        values, iterations = np.zeros(np.shape(x)), np.zeros(np.shape(x), dtype=int)
+        values[shared] = self.known[(y[shared] + y_c) // 2 - y_c // 2, (x[shared] + x_c) // 2 - x_c // 2]
+        shared &= values != 0  # 0 is the value of pixels that never escaped and of some that did, only their counts tell which, so they are evaluated again
+        iterations[shared] = -1  # counts of escaped pixels are not kept, -1 never equals a computed one, so uniform_fill does not fill from it
+        if not shared.all():
+            values[~shared], iterations[~shared] = super().evaluate(x[~shared], y[~shared])
+        self.stats['reused pixels'] += int(np.count_nonzero(shared))
+        return values, iterations
+
+
+class MandelbrotZoom:
+    __slots__ = ('target', 'zoom', 'frames', 'radius', 'size', 'shape', 'precision', 'keyframe')
+
+    def __init__(self, target: complex or tuple, f: Callable, *args, zoom: float = 1e6, frames: int = 300, radius: float = 2., aspect: float = 16 / 9, keyframe_scale: float = 2., **kwargs):
+        '''frames of width w zoom from the half width radius around target by zoom in total, target may be (re, im) as Decimal or str for deep_zoom
+        keyframes at zoom 1, 2, 4, ... are rendered keyframe_scale times as wide as the frames, which are resampled from them'''
+        if zoom < 1:
+            raise ValueError(f"'zoom' must be at least 1 not {zoom}")
+        if keyframe_scale < 1:
+            raise ValueError(f"'keyframe_scale' must be at least 1 not {keyframe_scale}")
+        if not isinstance(target, tuple):
+            target = complex(target)
+            target = (target.real, target.imag)
+        self.keyframe = Keyframe(f, *args, **kwargs)
+        if self.keyframe.oversample > 1 or self.keyframe.adaptive:
+            raise ValueError("'oversample' and 'adaptive' would move samples off the pixels keyframes share, use 'keyframe_scale'")
+        self.keyframe.info = False
+
+        w = self.keyframe.w
+        self.size = (2 * ceil(w / 2), max(2, 2 * round(w / aspect / 2)))  # even, the encoder drops an odd last row or column
+        self.shape = (2 * ceil(keyframe_scale * w / 2), 2 * ceil(keyframe_scale * self.size[1] / 2))  # even, so that the center pixels of keyframes line up
+        self.keyframe.w = self.shape[0]
+        self.precision = max(30, ceil(log10(self.shape[0] * zoom / (2 * radius))) + 20)  # see perturbation.Reference
+        self.target = tuple(Decimal(t) for t in target)
+        self.zoom = zoom
+        self.frames = frames
+        self.radius = radius
+
+    def view(self, k: int) -> tuple[tuple, tuple]:  # real and imag of keyframe k at zoom 2 ** k, target is its center pixel (w // 2, h // 2)
+        (w, h), (re, im) = self.shape, self.target
+        with localcontext() as context:
+            context.prec = self.precision
+            step = Decimal(2 * self.radius) / w / 2 ** k
+            real, imag = (re - w // 2 * step, re + w // 2 * step), (im - h // 2 * step, im + h // 2 * step)
+        if self.keyframe.deep_zoom:
+            return real, imag
+        return tuple(map(float, real)), tuple(map(float, imag))
+
+    def shared(self, arr: np.ndarray) -> np.ndarray:  # the part of keyframe arr that the next keyframe takes pixels from, see Keyframe.evaluate
+        (w, h), (x_c, y_c) = self.shape, (self.shape[0] // 2, self.shape[1] // 2)
+        return arr[y_c // 2:y_c // 2 + h // 2 + 1, x_c // 2:x_c // 2 + w // 2 + 1].copy()
+
+    def segments(self) -> list[list[tuple[int, float]]]:  # (t, depth - k) of the frames resampled from keyframe k, depth is log2 of their zoom
+        keyframes = floor(log2(self.zoom) + 1e-9) + 1
+        segments = [[] for _ in range(keyframes)]
+        for t in range(self.frames + 1):
+            depth = log2(self.zoom) * t / max(1, self.frames)
+            k = min(floor(depth + 1e-9), keyframes - 1)
+            segments[k].append((t, max(0., depth - k)))
+        return segments
+
+    def encode(self, video: cv2.VideoWriter, keyframes: Queue, flip: tuple[bool, bool], normalizations: Callable[[np.ndarray, tuple, tuple, float], Callable], errors: list) -> None:
+        # encoder thread, (arr, statistics, statistics of the next keyframe, segment) from keyframes until None
+        lr, ud = flip
+        scale = self.shape[0] / self.size[0]  # pixels of a keyframe per frame pixel at its own zoom
+        while (item := keyframes.get()) is not None:
+            if errors:  # keep draining so that the renderer never blocks
+                continue
+            try:
+                arr, first, last, segment = item
+                for t, u in segment:
+                    frame = resample(arr, scale * 2 ** -u, self.size)
+                    frame = normalizations(frame, first, last, u)(frame)
+                    frame = frame[::-1] if ud else frame
+                    video.write((255 * np.clip(frame[:, ::-1] if lr else frame, 0, 1)).astype(np.uint8))
+            except Exception as error:
+                errors.append(error)
+
+    def get(self, file: str = None, extension: str = '.mp4', fps: int = 30, size_offset: int = 3, percentile: float = 3, tone: str = 'asinh', normalization: str = 'keyframe'):
+        '''keyframes are rendered one after the other by one pool, each computes only the pixels it does not share with the previous one
+        frames are resampled from the keyframe at or below their zoom and encoded by a thread while the next keyframe renders, so at most three keyframes are kept
+        normalization is 'keyframe' (statistics of the keyframes, interpolated between them) or 'frame' (every frame on its own, flickers)'''
+        if normalization not in ZOOM_NORMALIZATIONS:
+            raise ValueError(f"'normalization' must be one of {ZOOM_NORMALIZATIONS} not {normalization!r}")
+        if normalization != 'frame' and tone == 'equalize':
+            raise ValueError("'equalize' needs the histogram of every frame, use normalization='frame'")
+        start = time.perf_counter()
+        keyframe, segments = self.keyframe, self.segments()
+        context = keyframe.context or RenderContext(keyframe.threads)  # one pool for all keyframes
+        context.open()
+        print(f'[INFO] get | {keyframe.threads} threads | size = (w={self.size[0]}, h={self.size[1]}) | keyframes = {len(segments)} of (w={self.shape[0]}, h={self.shape[1]}) | iterations = {keyframe.max_iterations}')
+
+        keyframe.real, keyframe.imag = self.view(0)
+        flip = keyframe.flip  # of the first view for all frames, deeper views may flip differently
+        kernel = keyframe.kernel
+        if keyframe.deep_zoom and kernel.method == 'power' and kernel.c_coefficient == 1:  # every view is centered at target, so the orbit of the deepest one serves all
+            keyframe.orbit = perturbation.Reference(*self.view(len(segments) - 1), self.shape, kernel.degree, keyframe.max_iterations, keyframe.max_magnitude).orbit
+        if normalization == 'frame':
+            normalizations = lambda frame, first, last, u: keyframe.normalization(frame, percentile, tone) if frame.any() else np.zeros_like
+        else:
+            normalizations = lambda frame, first, last, u: np.zeros_like if (statistics := blend(first, last, u)) is None else tonemap.mapping(*statistics, tone)
+
+        video = cv2.VideoWriter('__temp_video__' + extension, cv2.VideoWriter_fourcc(*'mp4v'), fps, self.size, False)
+        keyframes, errors = Queue(maxsize=1), []
+        encoder = Thread(target=self.encode, args=(video, keyframes, flip, normalizations, errors), daemon=True)
+        encoder.start()
+        shared_context, keyframe.context, previous = keyframe.context, context, None
+        try:
+            for k, segment in enumerate(segments):
+                keyframe.real, keyframe.imag = self.view(k)
+                keyframe.known = None if previous is None else self.shared(previous[0])
+                keyframe.arr = None
+                keyframe.calculate(size_offset)
+                arr, stats = keyframe.arr, keyframe.stats
+                statistics = None
+                if normalization != 'frame':  # of the part frames show, a keyframe is keyframe_scale times as wide
+                    shown = resample(arr, self.shape[0] / self.size[0], self.size)
+                    statistics = tonemap.statistics(shown, percentile) if shown.any() else None
+                print(f'[INFO] get | keyframe {k + 1}/{len(segments)} in {round(keyframe.elapsed, 2)}s | {round(100 * stats["reused pixels"] / arr.size, 1)}% reused')
+                if previous is not None:
+                    keyframes.put((*previous, statistics, segments[k - 1]))
+                previous = arr, statistics
+            keyframes.put((*previous, None, segments[-1]))
+        finally:
+            keyframes.put(None)
+            encoder.join()
+            video.release()
+            keyframe.context, keyframe.known, keyframe.arr = shared_context, None, None
+            if shared_context is None:
+                context.close()
+        if errors:
+            raise errors[0]
 
-        print(f'[INFO] get | {self.julia.threads} threads | size = (w={self.julia.w}, h={self.julia.h()}) | iterations = {self.julia.max_iterations}')
-        video = cv2.VideoWriter('__temp_video__' + extension, cv2.VideoWriter_fourcc(*'mp4v'), fps, (self.julia.h(), self.julia.w), False)
-        for frame in range(self.frames + 1):
-            self.julia.c = self.f_c(frame)
-            self.julia.calculate(size_offset)
-            print(f'\r[INFO] get | {round(100 * frame/self.frames, 2)}%', end='')
-            arr = self.julia.normalize_arr(self.julia.arr, percentile)
-            video.write((255 * arr/arr.max()).astype(np.uint8))
-        video.release()
         if file is None:
-            file = f'JuliaVideo; c({str(self.start).replace("j", "i")}, {str(self.end).replace("j", "i")}) ;z({self.julia.z_range}); i({self.julia.max_iterations}, {self.julia.extra_iterations}); img({self.julia.w}, {self.julia.h() + abs(self.julia.h_mirrored)}); r{self.julia.max_magnitude}; th{self.julia.threads}; t{round(time.perf_counter() - start, 2)}; o{self.julia.oversample}'
+            target = f'{self.target[0]}{"" if self.target[1] < 0 else "+"}{self.target[1]}i'
+            file = f'MandelbrotZoom; c({target}); x{self.zoom:g}; i({keyframe.max_iterations}, {keyframe.extra_iterations}); img({self.size[0]}, {self.size[1]}); r{keyframe.max_magnitude}; th{keyframe.threads}; t{round(time.perf_counter() - start, 2)}; {normalization}'
         os.rename('__temp_video__' + extension, file + extension)
+        print(f"[INFO] get | saved to '{file}{extension}'")
 
 
 def f(z, c):
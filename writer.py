@@ -0,0 +1,128 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import struct
+from typing import Iterable
+import zlib
+
+
+class StripWriter(ABC):  # writes an image row strip by row strip, strips are (rows, w) gray or (rows, w, 3) BGR like cv2
+    def __init__(self, filename: str, shape: tuple[int, int], dtype, channels: int = 1):
+        if np.dtype(dtype) not in (np.uint8, np.uint16):
+            raise ValueError(f"'dtype' must be uint8 or uint16 not {np.dtype(dtype)}")
+        if channels not in (1, 3):
+            raise ValueError(f"'channels' must be 1 or 3 not {channels}")
+        self.filename = filename
+        self.h, self.w = shape
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.rows = 0
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.filename, 'wb')
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        try:
+            if exc_type is None:
+                if self.rows != self.h:
+                    raise ValueError(f'wrote {self.rows} of {self.h} rows')
+                self.end()
+        finally:
+            self.file.close()
+
+    def pixels(self, strip: np.ndarray) -> bytes:  # RGB, most significant byte first
+        if strip.shape[1:] != ((self.w,) if self.channels == 1 else (self.w, 3)):
+            raise ValueError(f'strip of shape {strip.shape} does not fit width {self.w} with {self.channels} channels')
+        if self.channels == 3:
+            strip = strip[..., ::-1]
+        return np.ascontiguousarray(strip, dtype=self.dtype.newbyteorder('>')).tobytes()
+
+    def write(self, strip: np.ndarray) -> None:
+        self.write_pixels(strip)
+        self.rows += len(strip)
+
+    def write_strips(self, strips: Iterable[np.ndarray]) -> None:
+        for strip in strips:
+            self.write(strip)
+
+    def begin(self) -> None:
+        pass
+
+    @abstractmethod
+    def write_pixels(self, strip: np.ndarray) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+class PNGWriter(StripWriter):
+    def begin(self) -> None:
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        color_type = 0 if self.channels == 1 else 2
+        self.chunk(b'IHDR', struct.pack('>IIBBBBB', self.w, self.h, 8 * self.dtype.itemsize, color_type, 0, 0, 0))
+        self.compressor = zlib.compressobj(6)
+
+    def chunk(self, kind: bytes, data: bytes) -> None:
+        self.file.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write_pixels(self, strip: np.ndarray) -> None:
+        row = self.w * self.channels * self.dtype.itemsize
+        data = np.frombuffer(self.pixels(strip), dtype=np.uint8).reshape(len(strip), row)
+        data = np.concatenate((np.zeros((len(strip), 1), dtype=np.uint8), data), axis=1)  # filter type 0 per row
+        compressed = self.compressor.compress(data.tobytes())
+        if compressed:
+            self.chunk(b'IDAT', compressed)
+
+    def end(self) -> None:
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+
+
+class TIFFWriter(StripWriter):  # baseline big-endian TIFF, uncompressed, one TIFF strip per written strip
+    def begin(self) -> None:
+        self.file.write(b'MM\x00\x2a' + struct.pack('>I', 0))  # offset of the IFD is patched in end()
+        self.offsets, self.counts = [], []
+
+    def write_pixels(self, strip: np.ndarray) -> None:
+        data = self.pixels(strip)
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+
+    def end(self) -> None:
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        arrays = self.file.tell()  # StripOffsets, StripByteCounts and BitsPerSample do not fit into their entries
+        self.file.write(struct.pack(f'>{len(self.offsets)}I', *self.offsets))
+        self.file.write(struct.pack(f'>{len(self.counts)}I', *self.counts))
+        bits = arrays + 8 * len(self.offsets)
+        self.file.write(struct.pack(f'>{self.channels}H', *[8 * self.dtype.itemsize] * self.channels))
+        if self.file.tell() % 2:
+            self.file.write(b'\x00')
+        ifd = self.file.tell()
+
+        rows = self.h if len(self.counts) == 1 else max(self.counts) // (self.w * self.channels * self.dtype.itemsize)
+        n = len(self.offsets)
+        entries = [(256, 4, 1, self.w), (257, 4, 1, self.h),
+                   (258, 3, self.channels, bits if self.channels > 2 else 8 * self.dtype.itemsize),
+                   (259, 3, 1, 1), (262, 3, 1, 1 if self.channels == 1 else 2),
+                   (273, 4, n, arrays if n > 1 else self.offsets[0]), (277, 3, 1, self.channels),
+                   (278, 4, 1, rows), (279, 4, n, arrays + 4 * n if n > 1 else self.counts[0])]
+        self.file.write(struct.pack('>H', len(entries)))
+        for tag, kind, count, value in entries:
+            field = struct.pack('>HH', value, 0) if kind == 3 and count == 1 else struct.pack('>I', value)
+            self.file.write(struct.pack('>HHI', tag, kind, count) + field)
+        self.file.write(struct.pack('>I', 0))
+        self.file.seek(4)
+        self.file.write(struct.pack('>I', ifd))
+
+
+def writer(filename: str, shape: tuple[int, int], dtype, channels: int = 1) -> StripWriter:
+    if filename.lower().endswith('.png'):
+        return PNGWriter(filename, shape, dtype, channels)
+    elif filename.lower().endswith(('.tif', '.tiff')):
+        return TIFFWriter(filename, shape, dtype, channels)
+    raise ValueError(f"cannot write {filename!r}, extension must be '.png', '.tif' or '.tiff'")